@@ -1,3 +1,4 @@
+import crypto from 'crypto';
 import fs from 'fs';
 import path from 'path';
 
@@ -5,8 +6,22 @@ interface EmbeddingMap {
     [code: string]: number; // Maps code to index in vector array
 }
 
+// Header of municipality_vectors.bin (see scripts/ml/convert_embeddings.py)
+interface VectorFileHeader {
+    version: number;
+    dtype: 'float32' | 'float16';
+    byteOrder: 'little';
+    shape: [number, number];
+    model: string;
+    checksum: string;
+}
+
+const VECTOR_FILE_MAGIC = 'MVEC';
+const VECTOR_FILE_VERSION = 1;
+const ITEM_SIZES = { float32: 4, float16: 2 };
+
 export class SemanticSearchService {
-    private vectors: number[][] = [];
+    private vectors: ArrayLike<number>[] = [];
     private codeMap: EmbeddingMap = {};
     private indexMap: string[] = []; // Maps index to code
     private isLoaded = false;
@@ -18,13 +33,21 @@ export class SemanticSearchService {
     private loadData() {
         try {
             const dataDir = path.join(__dirname, '../../../data/cleaned');
+            const binPath = path.join(dataDir, 'municipality_vectors.bin');
             const vectorsPath = path.join(dataDir, 'municipality_vectors.json');
             const mapPath = path.join(dataDir, 'municipality_embedding_map.json');
 
-            if (fs.existsSync(vectorsPath) && fs.existsSync(mapPath)) {
+            if ((fs.existsSync(binPath) || fs.existsSync(vectorsPath)) && fs.existsSync(mapPath)) {
                 console.log('Loading semantic vectors...');
-                this.vectors = JSON.parse(fs.readFileSync(vectorsPath, 'utf-8'));
+                // Prefer the compact binary export; JSON is the legacy format
+                this.vectors = fs.existsSync(binPath)
+                    ? this.readBinaryVectors(binPath)
+                    : JSON.parse(fs.readFileSync(vectorsPath, 'utf-8'));
                 this.codeMap = JSON.parse(fs.readFileSync(mapPath, 'utf-8'));
+                const mapSize = Object.keys(this.codeMap).length;
+                if (mapSize !== this.vectors.length) {
+                    throw new Error(`Embedding map has ${mapSize} codes but there are ${this.vectors.length} vectors`);
+                }
 
                 // Reverse map for lookup
                 this.indexMap = new Array(this.vectors.length);
@@ -42,6 +65,55 @@ export class SemanticSearchService {
         }
     }
 
+    private readBinaryVectors(filePath: string): Float32Array[] {
+        const buf = fs.readFileSync(filePath);
+        if (buf.toString('latin1', 0, 4) !== VECTOR_FILE_MAGIC) {
+            throw new Error(`Not a vector export: ${filePath}`);
+        }
+        const headerLength = buf.readUInt32LE(4);
+        const header: VectorFileHeader = JSON.parse(buf.toString('utf-8', 8, 8 + headerLength));
+        if (header.version !== VECTOR_FILE_VERSION) {
+            throw new Error(`Unsupported vector file version ${header.version}: ${filePath}`);
+        }
+        if (!(header.dtype in ITEM_SIZES)) {
+            throw new Error(`Unsupported vector dtype ${header.dtype}: ${filePath}`);
+        }
+        const [rows, dim] = header.shape;
+        const body = buf.subarray(8 + headerLength);
+        if (body.length !== rows * dim * ITEM_SIZES[header.dtype]) {
+            throw new Error(`Vector file is truncated or has trailing data: ${filePath}`);
+        }
+        const checksum = `sha256:${crypto.createHash('sha256').update(body).digest('hex')}`;
+        if (checksum !== header.checksum) {
+            throw new Error(`Vector file checksum mismatch: ${filePath}`);
+        }
+        const data = new Float32Array(rows * dim);
+        const view = new DataView(body.buffer, body.byteOffset, body.length);
+
+        if (header.dtype === 'float32') {
+            for (let i = 0; i < data.length; i++) data[i] = view.getFloat32(i * 4, true);
+        } else {
+            for (let i = 0; i < data.length; i++) data[i] = this.halfToFloat(view.getUint16(i * 2, true));
+        }
+
+        // One contiguous buffer, one view per row
+        const vectors: Float32Array[] = new Array(rows);
+        for (let r = 0; r < rows; r++) {
+            vectors[r] = data.subarray(r * dim, (r + 1) * dim);
+        }
+        console.log(`Vector file: ${header.dtype} ${rows}x${dim} (model: ${header.model})`);
+        return vectors;
+    }
+
+    private halfToFloat(h: number): number {
+        const sign = h & 0x8000 ? -1 : 1;
+        const exponent = (h >> 10) & 0x1f;
+        const fraction = h & 0x3ff;
+        if (exponent === 0) return sign * Math.pow(2, -14) * (fraction / 1024);
+        if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+        return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+    }
+
     findSimilar(targetCode: string, topK: number = 3): { code: string; score: number }[] {
         if (!this.isLoaded) return [];
 
@@ -69,7 +141,7 @@ export class SemanticSearchService {
         }));
     }
 
-    private dotProduct(v1: number[], v2: number[]): number {
+    private dotProduct(v1: ArrayLike<number>, v2: ArrayLike<number>): number {
         let sum = 0;
         for (let i = 0; i < v1.length; i++) {
             sum += v1[i] * v2[i];
@@ -0,0 +1,57 @@
+# Polls the search artifacts (embeddings, map, cleaned table, ...) and calls back when they change.
+import os
+import asyncio
+
+
+def artifact_version(paths):
+    # (path, mtime_ns, size) per file; None for missing files
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append((path, None, None))
+    return tuple(version)
+
+
+class ArtifactWatcher:
+    def __init__(self, paths, on_change, interval_s=30.0):
+        self.paths = list(paths)
+        self.on_change = on_change
+        self.interval_s = interval_s
+        self.version = artifact_version(self.paths)
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.interval_s > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        pending = None
+        while True:
+            await asyncio.sleep(self.interval_s)
+            current = artifact_version(self.paths)
+            if current == self.version:
+                pending = None
+                continue
+            if current != pending:
+                # The pipeline rewrites several files in turn; wait until a version holds for one interval
+                pending = current
+                continue
+            # Recorded before the callback so a rejected version is not retried until files change again
+            self.version = current
+            pending = None
+            try:
+                await self.on_change()
+            except Exception as e:
+                print(f"Artifact reload failed: {e}")
@@ -0,0 +1,65 @@
+# Filter indexes aligned to the embedding rows: row numbers per prefecture, and rows sorted by
+# each numeric column for range filters. Plain NumPy arrays, so shared_store.py can memory-map them.
+import numpy as np
+
+NUMERIC_COLUMNS = ('population', 'budget', 'score')
+
+
+class AttributeIndex:
+    def __init__(self, rows, prefecture_rows, sorted_columns):
+        # prefecture_rows: {prefecture: rows}, sorted_columns: {column: (order, values)}
+        self.rows = rows
+        self.prefecture_rows = prefecture_rows
+        self.sorted_columns = sorted_columns
+
+    @classmethod
+    def build(cls, codes, table):
+        # codes are in embedding row order
+        table = table.drop_duplicates(subset=['code']).set_index('code').reindex(codes)
+
+        prefecture_rows = {}
+        if 'prefecture' in table.columns:
+            prefectures = table['prefecture'].astype(object).fillna('').to_numpy()
+            for prefecture in np.unique(prefectures):
+                if prefecture:
+                    prefecture_rows[prefecture] = np.flatnonzero(prefectures == prefecture)
+
+        sorted_columns = {}
+        for column in NUMERIC_COLUMNS:
+            if column not in table.columns:
+                continue
+            values = table[column].to_numpy(dtype=np.float64, na_value=np.nan)
+            # Rows without a value never match a range filter
+            valid = np.flatnonzero(~np.isnan(values))
+            order = valid[np.argsort(values[valid], kind='stable')]
+            sorted_columns[column] = (order, values[order])
+        return cls(len(codes), prefecture_rows, sorted_columns)
+
+    def range_mask(self, column, low=None, high=None):
+        # Rows with low <= value <= high; None means unbounded
+        mask = np.zeros(self.rows, dtype=bool)
+        if column not in self.sorted_columns:
+            return mask
+        order, values = self.sorted_columns[column]
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        stop = len(values) if high is None else np.searchsorted(values, high, side='right')
+        mask[order[start:stop]] = True
+        return mask
+
+    def select(self, prefectures=None, ranges=None):
+        # Ascending rows matching every filter, or None when no filter is set
+        mask = None
+        if prefectures is not None:
+            mask = np.zeros(self.rows, dtype=bool)
+            for prefecture in prefectures:
+                rows = self.prefecture_rows.get(prefecture)
+                if rows is not None:
+                    mask[rows] = True
+
+        for column, (low, high) in (ranges or {}).items():
+            if low is None and high is None:
+                continue
+            column_mask = self.range_mask(column, low, high)
+            mask = column_mask if mask is None else mask & column_mask
+
+        return None if mask is None else np.flatnonzero(mask)
@@ -0,0 +1,92 @@
+# Micro-batches queries that arrive within max_wait_ms into one model.encode call.
+import asyncio
+
+import numpy as np
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EncodeBatcher:
+    # runner (e.g. InferencePool.run_encode) moves the encode off the event loop
+    def __init__(self, encode_fn, max_batch_size=32, max_wait_ms=5.0, runner=None):
+        self.encode_fn = encode_fn
+        self.runner = runner
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = None
+        self._worker = None
+        self._inflight = set()
+
+    def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def encode(self, text):
+        # Normalized vector for one query, encoded together with concurrent callers
+        if self._worker is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _collect(self):
+        text, future = await self._queue.get()
+        batch = [(text, future)]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Callers that gave up (e.g. client disconnect) are dropped from the batch
+            batch = [(text, future) for text, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            # Dispatch without waiting so the next batch is collected while this one encodes
+            task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            if self.runner is not None:
+                raw = await self.runner(self.encode_fn, texts)
+            else:
+                raw = self.encode_fn(texts)
+            vectors = normalize_rows(raw)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
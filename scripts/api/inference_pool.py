@@ -0,0 +1,51 @@
+# Runs model.encode and scoring on a thread pool so the event loop (and /health) stays responsive,
+# and rejects requests beyond max_pending with Overloaded (503 + Retry-After).
+# torch and BLAS release the GIL, so threads use several cores; a process pool would copy the model per worker.
+# model.encode runs on a separate single thread: the model's fast tokenizer is not re-entrant
+# ("Already borrowed"), so encodes are serialized while scoring keeps the pool.
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Search service overloaded")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    def __init__(self, max_workers=2, max_pending=64, retry_after=1):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inference')
+        self._encode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='encode')
+
+    @contextlib.contextmanager
+    def admit(self):
+        # Only called on the event loop thread, so the counter needs no lock
+        if self.pending >= self.max_pending:
+            raise Overloaded(self.retry_after)
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def run_encode(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._encode_executor, fn, *args)
+
+    def encode_blocking(self, fn, *args):
+        # For code already running on the pool (e.g. /search/batch)
+        return self._encode_executor.submit(fn, *args).result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        self._encode_executor.shutdown(wait=True)
@@ -0,0 +1,127 @@
+"""
+IVF index: only rows in the nprobe partitions nearest to the query are scored.
+
+Recall and latency against exact search:
+    python -m scripts.api.ivf_index evaluate --nprobe 1 2 4 8 16 --top-k 10
+"""
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from scripts.api.vector_store import VectorStore, top_k_indices
+
+
+class IVFIndex:
+    # k-means centroids and the rows of each partition in CSR form (list_offsets, list_rows),
+    # as written by scripts/ml/build_ivf_index.py. fingerprint identifies the embeddings it was built from.
+    def __init__(self, centroids, list_offsets, list_rows, fingerprint=None):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            fingerprint = str(data['fingerprint']) if 'fingerprint' in data.files else None
+            return cls(data['centroids'], data['list_offsets'], data['list_rows'], fingerprint)
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    @property
+    def rows(self):
+        return self.list_rows.shape[0]
+
+    def probe(self, query, nprobe):
+        partitions = top_k_indices(np.dot(self.centroids, query), nprobe)
+        lists = [self.list_rows[self.list_offsets[p]:self.list_offsets[p + 1]] for p in partitions]
+        # Ascending rows keep the gather from the memory-mapped matrix sequential
+        return np.sort(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int64)
+
+    def candidates(self, query, nprobe, rows=None):
+        # Rows to score, intersected with the filter rows; None means all rows
+        if nprobe >= self.nlist:
+            return rows
+        probed = self.probe(query, nprobe)
+        if rows is None:
+            return probed
+        # A filter selecting no more rows than the probe is cheaper, and exact, to score in full
+        if len(rows) <= len(probed):
+            return rows
+        return np.intersect1d(probed, rows, assume_unique=True)
+
+
+def evaluate(store, ivf, queries, k, nprobes):
+    # recall@k and per-query latency for each nprobe, against exact search
+    exact_topk = []
+    exact_times = []
+    for query in queries:
+        start = time.perf_counter()
+        indices, _ = store.top_k(query, k)
+        exact_times.append(time.perf_counter() - start)
+        exact_topk.append(set(indices.tolist()))
+
+    results = [{
+        'nprobe': 'exact', 'recall_at_k': 1.0, 'scored_fraction': 1.0,
+        'mean_ms': round(float(np.mean(exact_times)) * 1000, 3),
+        'p95_ms': round(float(np.percentile(exact_times, 95)) * 1000, 3),
+    }]
+    for nprobe in nprobes:
+        recalls, times, scored = [], [], []
+        for query, expected in zip(queries, exact_topk):
+            start = time.perf_counter()
+            rows = ivf.candidates(query, nprobe)
+            indices, _ = store.top_k(query, k, rows=rows)
+            times.append(time.perf_counter() - start)
+            recalls.append(len(expected & set(indices.tolist())) / max(len(expected), 1))
+            scored.append(len(store) if rows is None else len(rows))
+        results.append({
+            'nprobe': nprobe,
+            'recall_at_k': round(float(np.mean(recalls)), 4),
+            'scored_fraction': round(float(np.mean(scored)) / len(store), 4),
+            'mean_ms': round(float(np.mean(times)) * 1000, 3),
+            'p95_ms': round(float(np.percentile(times, 95)) * 1000, 3),
+        })
+    return results
+
+
+def main():
+    cleaned_dir = os.path.join(os.path.dirname(__file__), '../../data/cleaned')
+    parser = argparse.ArgumentParser(description="Evaluate IVF recall and latency against exact search.")
+    parser.add_argument('command', choices=['evaluate'])
+    parser.add_argument('--embeddings', default=os.path.join(cleaned_dir, 'municipality_embeddings.npy'))
+    parser.add_argument('--index', default=os.path.join(cleaned_dir, 'municipality_ivf.npz'))
+    parser.add_argument('--dtype', choices=['float32', 'float16', 'int8'], default='float32')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--output', help="Write the results as JSON")
+    args = parser.parse_args()
+
+    store = VectorStore.open(args.embeddings, args.dtype)
+    ivf = IVFIndex.load(args.index)
+    if ivf.rows != len(store):
+        raise SystemExit(f"IVF index covers {ivf.rows} rows but embeddings have {len(store)}; rebuild it")
+
+    # Use stored rows themselves as probe queries, as vector_store check does
+    rng = np.random.default_rng(42)
+    probe = rng.choice(len(store), size=min(args.queries, len(store)), replace=False)
+    queries = np.asarray(VectorStore.open(args.embeddings).vectors[np.sort(probe)], dtype=np.float32)
+
+    results = evaluate(store, ivf, queries, args.top_k, args.nprobe)
+    print(f"rows={len(store)} nlist={ivf.nlist} k={args.top_k} queries={len(queries)} dtype={args.dtype}")
+    for row in results:
+        print(f"  nprobe={row['nprobe']!s:>5}  recall@k={row['recall_at_k']:.4f}  "
+              f"scored={row['scored_fraction']:.3f}  mean={row['mean_ms']:.3f} ms  p95={row['p95_ms']:.3f} ms")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'rows': len(store), 'nlist': ivf.nlist, 'k': args.top_k, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# Minimal Prometheus text-format metrics (per uvicorn worker) and per-request stage timings
+# for the Server-Timing header.
+import time
+import threading
+import contextlib
+
+# Seconds; covers a cache-hit lookup (~0.1 ms) up to a cold model encode on CPU
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        out = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                out.append((f'{self.name}_bucket', labels, cumulative))
+            out.append((f'{self.name}_sum', _format_labels(self.labelnames, key), total))
+            out.append((f'{self.name}_count', _format_labels(self.labelnames, key), cumulative))
+        return out
+
+
+class Gauge:
+    # Read at render time: fn() returns a number, or {label values tuple: number} with labelnames
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn, labelnames=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        value = self.fn()
+        if not self.labelnames:
+            return [(self.name, '', value)] if value is not None else []
+        return [(self.name, _format_labels(self.labelnames, key), v)
+                for key, v in value.items() if v is not None]
+
+
+class CounterFunc(Gauge):
+    # Counter whose running totals are kept elsewhere (e.g. by QueryCache), read at render time like a Gauge
+    kind = 'counter'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimer:
+    # stage() is also called from pool threads, but one request's stages run one after another, so no lock
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        parts = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.stages.items()]
+        parts.append(f'total;dur={self.total() * 1000:.3f}')
+        return ', '.join(parts)
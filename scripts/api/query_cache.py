@@ -0,0 +1,160 @@
+# Query embedding cache keyed by (model, normalized query): an in-process LRU in front of an
+# optional SQLite store that survives restarts. Both levels expire entries after ttl_seconds;
+# the SQLite store is also capped at max_disk_entries rows, pruned every PRUNE_EVERY writes.
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+_WHITESPACE = re.compile(r'\s+')
+PRUNE_EVERY = 256
+
+
+def normalize_query(text):
+    # Callers encode the normalized text too, so equal keys always map to the same vector.
+    # Case is kept: the model is cased.
+    text = unicodedata.normalize('NFKC', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class QueryCache:
+    def __init__(self, model_id, max_entries=4096, ttl_seconds=7 * 24 * 3600, db_path=None,
+                 max_disk_entries=100000, dim=None):
+        self.model_id = model_id
+        # Vector size of the loaded model; cached vectors of another size (e.g. an older model revision) are dropped
+        self.dim = dim
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl_seconds
+        self.db_path = db_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._writes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = self._open_db(db_path) if db_path else None
+
+    def _open_db(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        db = sqlite3.connect(db_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings ("
+            " model_id TEXT NOT NULL,"
+            " query TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (model_id, query))"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS query_embeddings_created_at ON query_embeddings (created_at)")
+        self._prune(db, time.time())
+        db.commit()
+        return db
+
+    def _prune(self, db, now):
+        # Expired rows first, then the oldest rows beyond max_disk_entries
+        if self.ttl is not None:
+            db.execute("DELETE FROM query_embeddings WHERE created_at < ?", (now - self.ttl,))
+        if self.max_disk_entries:
+            db.execute(
+                "DELETE FROM query_embeddings WHERE rowid IN ("
+                " SELECT rowid FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _usable(self, vector, created_at, now):
+        return not self._expired(created_at, now) and (self.dim is None or vector.shape == (self.dim,))
+
+    def get(self, query):
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, created_at = entry
+                if self._usable(vector, created_at, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+                self.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector, created_at FROM query_embeddings WHERE model_id = ? AND query = ?",
+                    (self.model_id, key),
+                ).fetchone()
+                if row is not None:
+                    blob, created_at = row
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    if self._usable(vector, created_at, now):
+                        self._remember(key, vector, created_at)
+                        self.disk_hits += 1
+                        return vector
+                    self._db.execute(
+                        "DELETE FROM query_embeddings WHERE model_id = ? AND query = ?",
+                        (self.model_id, key),
+                    )
+                    self._db.commit()
+                    self.expirations += 1
+
+            self.misses += 1
+            return None
+
+    def put(self, query, vector):
+        key = normalize_query(query)
+        vector = np.asarray(vector, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            self._remember(key, vector, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (model_id, query, vector, created_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (self.model_id, key, vector.tobytes(), now),
+                )
+                self._writes += 1
+                if self._writes % PRUNE_EVERY == 0:
+                    self._prune(self._db, now)
+                self._db.commit()
+
+    def _remember(self, key, vector, created_at):
+        self._entries[key] = (vector, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'model_id': self.model_id,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'persistent': self._db is not None,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
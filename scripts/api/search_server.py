@@ -1,12 +1,27 @@
 import os
 import json
+import time
+import asyncio
+import secrets
+from collections import namedtuple
 import numpy as np
 import pandas as pd
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer
 from typing import List, Optional
 
+from scripts.api.artifact_watcher import ArtifactWatcher, artifact_version
+from scripts.api.encode_batcher import EncodeBatcher, normalize_rows
+from scripts.api.inference_pool import InferencePool, Overloaded
+from scripts.api.ivf_index import IVFIndex
+from scripts.api.metrics import Counter, CounterFunc, Gauge, Histogram, Registry, RequestTimer
+from scripts.api.query_cache import QueryCache, normalize_query
+from scripts.api.shared_store import build_columns, publish_or_attach
+from scripts.api.vector_store import VectorStore, top_k_indices
+from scripts.embedding_fingerprint import fingerprint, read_manifest, set_matches
+
 app = FastAPI()
 
 # Paths
@@ -15,105 +30,617 @@ DATA_DIR = os.path.join(BASE_DIR, '../../data')
 METADATA_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_map.json')
 EMBEDDINGS_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embeddings.npy')
 MUNICIPALITIES_CSV = os.path.join(DATA_DIR, 'cleaned/municipalities_cleaned.csv')
+# Typed columnar copy written by transform_data.py; read instead of the CSV when present
+MUNICIPALITIES_ARROW = os.path.join(DATA_DIR, 'cleaned/municipalities_cleaned.arrow')
+KNN_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_knn.npz')
+IVF_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_ivf.npz')
+HASHES_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_hashes.json')
+
+# Columns read from the cleaned CSV (result fields + filterable attributes)
+METADATA_COLUMNS = ('code', 'name', 'prefecture', 'population', 'budget', 'score')
+
+MODEL_NAME = 'pkshatech/GLuCoSE-base-ja'
+
+# Storage dtype for the vector store: float32 | float16 | int8
+VECTOR_DTYPE = os.getenv('SEARCH_VECTOR_DTYPE', 'float32')
+
+# Micro-batching of concurrent /search queries; MAX_BATCH_SIZE also caps the queries per /search/batch request
+BATCH_WINDOW_MS = float(os.getenv('SEARCH_BATCH_WINDOW_MS', '5'))
+MAX_BATCH_SIZE = int(os.getenv('SEARCH_MAX_BATCH_SIZE', '32'))
+
+# Inference runs off the event loop; requests beyond MAX_PENDING are rejected with 503
+INFERENCE_WORKERS = int(os.getenv('SEARCH_INFERENCE_WORKERS', '2'))
+MAX_PENDING = int(os.getenv('SEARCH_MAX_PENDING', '64'))
+RETRY_AFTER_S = int(os.getenv('SEARCH_RETRY_AFTER_S', '1'))
+
+# Query embedding cache (in-memory LRU + SQLite). Empty SEARCH_CACHE_PATH disables the disk level.
+CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '4096'))
+CACHE_TTL_S = int(os.getenv('SEARCH_CACHE_TTL_S', str(7 * 24 * 3600)))
+CACHE_PATH = os.getenv('SEARCH_CACHE_PATH', os.path.join(DATA_DIR, 'cache/query_embeddings.sqlite'))
+CACHE_DISK_ENTRIES = int(os.getenv('SEARCH_CACHE_DISK_ENTRIES', '100000'))
+
+# Hot swap of artifacts: polling interval (0 disables the watcher) and token for POST /admin/reload.
+# Without a token, /admin/reload only accepts requests from localhost.
+RELOAD_POLL_S = float(os.getenv('SEARCH_RELOAD_POLL_S', '30'))
+ADMIN_TOKEN = os.getenv('SEARCH_ADMIN_TOKEN', '')
+LOCAL_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+# Directory for the memory-mapped store shared by uvicorn workers (see shared_store.py). Empty = per-process.
+SHARED_STORE_DIR = os.getenv('SEARCH_SHARED_STORE_DIR', '')
+
+# Default number of IVF partitions to score per query (see ivf_index.py). 0 = exact search over all rows.
+# Requests can override it with "nprobe"; it only applies when municipality_ivf.npz is loaded.
+IVF_NPROBE = int(os.getenv('SEARCH_IVF_NPROBE', '0'))
 
 # Globals
+pool = None
+query_cache = None
 model = None
-embeddings = None
-municipality_codes = []
-municipality_data = {}
+# Output dimension of the loaded model, measured on the warmup query
+model_dim = None
+encoder = None
+watcher = None
+reload_lock = None
+
+# Everything a search reads from the artifacts, swapped as one object on reload.
+# A request takes the snapshot once, so in-flight requests finish on the index they started with.
+# Per-row columns are NumPy arrays aligned to the embedding rows (memory-mapped in shared mode).
+SearchIndex = namedtuple('SearchIndex', ['embeddings', 'codes', 'names', 'prefectures', 'lookup', 'attributes',
+                                         'knn', 'ivf', 'model_id', 'encoded_dim', 'version', 'fingerprint',
+                                         'complete'])
+search_index = None
+reload_state = {"status": "idle", "last_error": None, "swapped_at": None, "load_seconds": None}
+
+class SearchFilters(BaseModel):
+    prefectures: Optional[List[str]] = None
+    population_min: Optional[float] = None
+    population_max: Optional[float] = None
+    budget_min: Optional[float] = None
+    budget_max: Optional[float] = None
+    score_min: Optional[float] = None
+    score_max: Optional[float] = None
 
 class SearchRequest(BaseModel):
     query: str
     top_k: int = 5
+    filters: Optional[SearchFilters] = None
+    nprobe: Optional[int] = None
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    filters: Optional[SearchFilters] = None
+    nprobe: Optional[int] = None
+
+# Per-resource readiness: pending -> loading -> ready | missing | error
+resources = {
+    name: {"status": "pending", "load_seconds": None}
+    for name in ('model', 'warmup', 'embeddings', 'mapping', 'metadata', 'attributes', 'knn', 'ivf')
+}
+REQUIRED_RESOURCES = ('model', 'warmup', 'embeddings', 'mapping', 'metadata', 'attributes')
+startup_task = None
+
+# Prometheus metrics (per worker process), served at /metrics
+CACHE_EVENTS = ('hits', 'disk_hits', 'misses', 'evictions', 'expirations')
+metrics = Registry()
+REQUEST_SECONDS = metrics.register(Histogram(
+    'search_request_seconds', 'Request latency by endpoint', ['endpoint']))
+STAGE_SECONDS = metrics.register(Histogram(
+    'search_stage_seconds', 'Time spent per hot-path stage (encode, probe, score, topk, assemble)', ['endpoint', 'stage']))
+REQUESTS_TOTAL = metrics.register(Counter(
+    'search_requests_total', 'Requests by endpoint and status code', ['endpoint', 'status']))
+metrics.register(Gauge(
+    'search_inflight_requests', 'Admitted search requests (running + waiting for the pool)',
+    lambda: pool.pending if pool is not None else 0))
+metrics.register(Gauge(
+    'search_encode_queue_depth', 'Queries waiting for the next encode batch',
+    lambda: encoder.queue_depth if encoder is not None else 0))
+metrics.register(Gauge(
+    'search_resource_load_seconds', 'Startup load time per resource',
+    lambda: {(name,): state["load_seconds"] for name, state in resources.items()}, ['resource']))
+metrics.register(Gauge(
+    'search_query_cache_entries', 'Query embeddings held in the in-memory cache',
+    lambda: query_cache.stats()['entries'] if query_cache is not None else None))
+metrics.register(CounterFunc(
+    'search_query_cache_events_total', 'Query embedding cache lookups and removals since startup',
+    lambda: {(event,): (query_cache.stats() if query_cache is not None else {}).get(event) for event in CACHE_EVENTS},
+    ['event']))
+
+def read_model():
+    return SentenceTransformer(MODEL_NAME)
+
+def warmup_model(loaded):
+    # First encode pays for lazy init (tokenizer, kernels); do it before reporting ready
+    return int(np.asarray(loaded.encode(["ウォームアップ"])).shape[-1])
+
+def read_embeddings():
+    if not os.path.exists(EMBEDDINGS_PATH):
+        print(f"Embeddings file not found at {EMBEDDINGS_PATH}")
+        return None
+    store = VectorStore.open(EMBEDDINGS_PATH, dtype=VECTOR_DTYPE)
+    print(f"Embeddings loaded: {store.shape} ({store.dtype}, memory-mapped)")
+    return store
+
+def read_mapping():
+    if not os.path.exists(METADATA_PATH):
+        return None
+    with open(METADATA_PATH, 'r', encoding='utf-8') as f:
+        mapping = json.load(f)
+    # mapping is code -> index. Inverse it (indices are expected to be contiguous 0..N-1)
+    codes = np.full(max(mapping.values()) + 1, "UNKNOWN", dtype=object)
+    codes[list(mapping.values())] = list(mapping.keys())
+    print(f"Metadata loaded: {len(codes)} items")
+    return codes.tolist()
+
+def read_metadata():
+    if os.path.exists(MUNICIPALITIES_ARROW):
+        # Only the needed columns, already typed (no CSV parsing or type inference)
+        df = pd.read_feather(MUNICIPALITIES_ARROW, columns=list(METADATA_COLUMNS))
+    elif os.path.exists(MUNICIPALITIES_CSV):
+        df = pd.read_csv(MUNICIPALITIES_CSV, usecols=lambda c: c in METADATA_COLUMNS,
+                         dtype={'code': str, 'name': str, 'prefecture': str})
+    else:
+        return None
+    print(f"Municipality data loaded: {len(df)} items")
+    return df
+
+def build_search_columns(codes, table):
+    # Result fields (Name, Prefecture) and filters, aligned to the embedding rows column-wise
+    columns = build_columns(codes, table)
+    print(f"Attribute index built: {len(columns.attributes.prefecture_rows)} prefectures, "
+          f"columns {sorted(columns.attributes.sorted_columns)}")
+    return columns
+
+def read_embedding_manifest():
+    # Written last by scripts/ml/generate_embeddings.py: model, vector dimension and the digests of the
+    # matrix and map. Read before them and checked against them in make_index
+    return read_manifest(HASHES_PATH) or {}
+
+def read_knn():
+    # Precomputed by scripts/ml/build_knn_table.py; optional
+    if not os.path.exists(KNN_PATH):
+        return None
+    with np.load(KNN_PATH) as table:
+        knn = {"indices": table["indices"], "scores": table["scores"],
+               "fingerprint": str(table["fingerprint"]) if "fingerprint" in table.files else None}
+    print(f"Neighbour table loaded: {knn['indices'].shape}")
+    return knn
+
+def read_ivf():
+    # Trained by scripts/ml/build_ivf_index.py; optional
+    if not os.path.exists(IVF_PATH):
+        return None
+    ivf = IVFIndex.load(IVF_PATH)
+    print(f"IVF index loaded: {ivf.nlist} lists over {ivf.rows} rows")
+    return ivf
+
+async def load_resource(name, fn, *args):
+    state = resources[name]
+    state["status"] = "loading"
+    start = time.perf_counter()
+    try:
+        value = await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+        state["status"] = "ready" if value is not None else "missing"
+    except Exception as e:
+        print(f"Error loading {name}: {e}")
+        state["status"] = "error"
+        state["error"] = str(e)
+        value = None
+    state["load_seconds"] = round(time.perf_counter() - start, 3)
+    return value
+
+async def load_model():
+    global model, model_dim, encoder
+    loaded = await load_resource('model', read_model)
+    if loaded is None:
+        resources['warmup']["status"] = "missing"
+        return
+    model_dim = await load_resource('warmup', warmup_model, loaded)
+    query_cache.dim = model_dim
+    # The index may have loaded first; check it against the model before serving searches
+    if search_index is not None and search_index.embeddings is not None:
+        accept_index(search_index)
+    model = loaded
+    encoder = EncodeBatcher(model.encode, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=BATCH_WINDOW_MS,
+                            runner=pool.run_encode)
+    encoder.start()
+
+def artifact_paths():
+    return [EMBEDDINGS_PATH, METADATA_PATH, MUNICIPALITIES_CSV, MUNICIPALITIES_ARROW, KNN_PATH, IVF_PATH, HASHES_PATH]
+
+def make_index(embeddings, columns, version, manifest):
+    columns = columns or build_columns([], None)
+    # Only the neighbour table and IVF lists are checked against the fingerprint; without a hashes file
+    # it means hashing the whole matrix
+    tables = columns.knn is not None or columns.ivf is not None
+    return SearchIndex(embeddings, *columns, manifest.get('model'), manifest.get('dim'), version,
+                       fingerprint(EMBEDDINGS_PATH, METADATA_PATH, manifest.get('files')) if tables else None,
+                       set_matches(manifest, EMBEDDINGS_PATH, METADATA_PATH))
+
+def read_columns():
+    codes = read_mapping()
+    if codes is None:
+        return None
+    table = read_metadata()
+    columns = build_search_columns(codes, table) if table is not None else build_columns(codes, None)
+    return columns._replace(knn=read_knn(), ivf=read_ivf())
+
+def open_shared_columns(version):
+    # The first worker to get here builds and publishes the store; the others attach to it
+    return publish_or_attach(SHARED_STORE_DIR, version, read_columns)
+
+async def load_embeddings():
+    return await load_resource('embeddings', read_embeddings)
+
+async def load_mapping():
+    return await load_resource('mapping', read_mapping) or []
+
+async def load_metadata():
+    return await load_resource('metadata', read_metadata)
+
+async def load_attributes():
+    # Needs the embedding order and the metadata table
+    codes, table = await asyncio.gather(load_mapping(), load_metadata())
+    if table is None or not codes:
+        resources['attributes']["status"] = "missing"
+        return build_columns(codes, None)
+    return await load_resource('attributes', build_search_columns, codes, table) or build_columns(codes, None)
+
+async def load_knn():
+    return await load_resource('knn', read_knn)
+
+async def load_ivf():
+    return await load_resource('ivf', read_ivf)
+
+async def load_columns():
+    columns, knn, ivf = await asyncio.gather(load_attributes(), load_knn(), load_ivf())
+    return columns._replace(knn=knn, ivf=ivf)
+
+async def load_shared_columns(version):
+    columns = await load_resource('attributes', open_shared_columns, version)
+    # Mapping, metadata, neighbours and IVF lists all come from the shared store
+    for name in ('mapping', 'metadata'):
+        resources[name]["status"] = resources['attributes']["status"]
+    for name in ('knn', 'ivf'):
+        resources[name]["status"] = "ready" if columns is not None and getattr(columns, name) is not None else "missing"
+    return columns
+
+async def load_index():
+    global search_index
+    version = artifact_version(artifact_paths())
+    manifest = read_embedding_manifest()
+    columns = load_shared_columns(version) if SHARED_STORE_DIR else load_columns()
+    embeddings, columns = await asyncio.gather(load_embeddings(), columns)
+    index = make_index(embeddings, columns, version, manifest)
+    if index.embeddings is None:
+        search_index = index
+    else:
+        accept_index(index)
+
+def accept_index(index):
+    # Startup runs the reload checks too; a rejected index is not served until a reload replaces it
+    global search_index
+    try:
+        search_index = validate_index(index, None)
+    except ValueError as e:
+        print(f"Index rejected: {e}")
+        resources['embeddings'].update(status="error", error=str(e))
+        reload_state.update(status="rejected", last_error=str(e))
+        search_index = None
+
+async def load_all():
+    await asyncio.gather(load_model(), load_index())
+    print("Resources loaded.")
+
+def read_index(version):
+    # Runs in a worker thread; builds a complete new index without touching the active one
+    manifest = read_embedding_manifest()
+    embeddings = read_embeddings()
+    columns = open_shared_columns(version) if SHARED_STORE_DIR else read_columns()
+    return make_index(embeddings, columns, version, manifest)
+
+def validate_index(new, current):
+    if new.embeddings is None:
+        raise ValueError("Embeddings file not found")
+    if not new.complete:
+        # The hashes file lands last, so its change triggers another reload once the set is complete
+        raise ValueError("Embeddings and map do not match the hashes file (set still being written or left incomplete)")
+    if len(new.codes) != len(new.embeddings):
+        raise ValueError(f"Embedding map has {len(new.codes)} rows but embeddings have {len(new.embeddings)}")
+    if new.model_id is not None and new.model_id != MODEL_NAME:
+        raise ValueError(f"Embeddings were built with {new.model_id}, the service runs {MODEL_NAME}")
+    if new.encoded_dim is not None and new.encoded_dim != new.embeddings.dim:
+        raise ValueError(f"Embeddings have dimension {new.embeddings.dim} but {new.model_id} recorded {new.encoded_dim}")
+    if model_dim is not None and new.embeddings.dim != model_dim:
+        raise ValueError(f"Embeddings have dimension {new.embeddings.dim}, {MODEL_NAME} encodes {model_dim}")
+    if current is not None and current.embeddings is not None and new.embeddings.dim != current.embeddings.dim:
+        raise ValueError(f"Embedding dimension changed ({current.embeddings.dim} -> {new.embeddings.dim})")
+    return drop_stale_tables(new)
+
+def drop_stale_tables(index):
+    # Neighbour table and IVF lists are rebuilt after the embeddings; serve without them until they catch up.
+    # They record the fingerprint of the embeddings and map they were built from (None for older files).
+    if index.embeddings is None:
+        return index
+    if index.knn is not None and (index.knn["fingerprint"] != index.fingerprint
+                                  or len(index.knn["indices"]) != len(index.codes)):
+        print("Neighbour table does not match the embeddings, /similar disabled until it is rebuilt")
+        index = index._replace(knn=None)
+    if index.ivf is not None and (index.ivf.fingerprint != index.fingerprint
+                                  or index.ivf.rows != len(index.codes)
+                                  or index.ivf.centroids.shape[1] != index.embeddings.dim):
+        print("IVF index does not match the embeddings, exact search until it is rebuilt")
+        index = index._replace(ivf=None)
+    return index
+
+async def reload_index():
+    # Reads the artifacts again and swaps the index in if it validates; returns whether it swapped
+    global search_index
+    async with reload_lock:
+        version = artifact_version(artifact_paths())
+        if watcher is not None:
+            watcher.version = version
+        reload_state["status"] = "loading"
+        start = time.perf_counter()
+        try:
+            new = await asyncio.get_running_loop().run_in_executor(None, read_index, version)
+            new = validate_index(new, search_index)
+        except Exception as e:
+            print(f"Index reload rejected: {e}")
+            reload_state.update(status="rejected", last_error=str(e))
+            return False
+        search_index = new
+        resources['embeddings'].update(status="ready", error=None)
+        reload_state.update(status="swapped", last_error=None, swapped_at=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                            load_seconds=round(time.perf_counter() - start, 3))
+        print(f"Search index swapped: {new.embeddings.shape}")
+        return True
 
 @app.on_event("startup")
 async def load_data():
-    global model, embeddings, municipality_codes, municipality_data
+    global pool, query_cache, startup_task, watcher, reload_lock
     
     print("Loading resources...")
-    
-    # Load Model
+
+    pool = InferencePool(max_workers=INFERENCE_WORKERS, max_pending=MAX_PENDING, retry_after=RETRY_AFTER_S)
+
     try:
-        model = SentenceTransformer('pkshatech/GLuCoSE-base-ja')
+        query_cache = QueryCache(MODEL_NAME, max_entries=CACHE_SIZE, ttl_seconds=CACHE_TTL_S,
+                                 db_path=CACHE_PATH or None, max_disk_entries=CACHE_DISK_ENTRIES)
     except Exception as e:
-        print(f"Error loading model: {e}")
-        # In production, we might want to fail hard, but for now log it
-    
-    # Load Embeddings
-    if os.path.exists(EMBEDDINGS_PATH):
-        embeddings = np.load(EMBEDDINGS_PATH)
-        print(f"Embeddings loaded: {embeddings.shape}")
-    else:
-        print(f"Embeddings file not found at {EMBEDDINGS_PATH}")
+        print(f"Error opening query cache at {CACHE_PATH}: {e}")
+        query_cache = QueryCache(MODEL_NAME, max_entries=CACHE_SIZE, ttl_seconds=CACHE_TTL_S)
 
-    # Load Metadata (Mapping)
-    if os.path.exists(METADATA_PATH):
-        with open(METADATA_PATH, 'r', encoding='utf-8') as f:
-            mapping = json.load(f)
-            # mapping is code -> index. Inverse it.
-            index_to_code = {v: k for k, v in mapping.items()}
-            # Verify indices are contiguous 0..N-1
-            max_idx = max(mapping.values())
-            municipality_codes = [index_to_code.get(i, "UNKNOWN") for i in range(max_idx + 1)]
-            print(f"Metadata loaded: {len(municipality_codes)} items")
-    
-    # Load CSV for extra data if needed (Name, Prefecture)
-    if os.path.exists(MUNICIPALITIES_CSV):
-        try:
-            df = pd.read_csv(MUNICIPALITIES_CSV)
-            # Create a dict for quick lookup
-            for _, row in df.iterrows():
-                municipality_data[str(row['code'])] = {
-                    "name": row['name'],
-                    "prefecture": row['prefecture']
-                }
-            print(f"CSV Data loaded: {len(municipality_data)} items")
-        except Exception as e:
-            print(f"Error loading CSV: {e}")
-            
-    print("Resources loaded.")
+    # Resources load concurrently in the background; /health reports per-resource progress
+    reload_lock = asyncio.Lock()
+    watcher = ArtifactWatcher(artifact_paths(), reload_index, interval_s=RELOAD_POLL_S)
+    startup_task = asyncio.get_running_loop().create_task(load_all())
+    watcher.start()
 
-@app.post("/search")
-async def search(req: SearchRequest):
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    # Endpoints add their stage timings to request.state.timer
+    timer = RequestTimer()
+    request.state.timer = timer
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    for stage, seconds in timer.stages.items():
+        STAGE_SECONDS.observe(seconds, endpoint=endpoint, stage=stage)
+    REQUEST_SECONDS.observe(timer.total(), endpoint=endpoint)
+    REQUESTS_TOTAL.inc(endpoint=endpoint, status=str(response.status_code))
+    response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+def build_results(index, indices, scores):
+    results = []
+    for idx, score in zip(indices, scores):
+        if idx < len(index.codes):
+            results.append({
+                "code": str(index.codes[idx]),
+                "score": float(score),
+                "name": str(index.names[idx]),
+                "prefecture": str(index.prefectures[idx])
+            })
+    return results
+
+def check_ready():
+    # Returns the index snapshot the request should use throughout
+    index = search_index
     if model is None:
          raise HTTPException(status_code=503, detail="Search service error: Model not loaded")
-    if embeddings is None:
+    if index is None or index.embeddings is None:
         raise HTTPException(status_code=503, detail="Search service error: Embeddings not loaded")
-        
-    try:
-        query_embedding = model.encode(req.query)
-        
-        # Normalize query
-        norm = np.linalg.norm(query_embedding)
-        if norm > 0:
-            query_embedding = query_embedding / norm
-            
-        # Cosine Similarity
-        scores = np.dot(embeddings, query_embedding)
-        
-        # Top K
-        # Get indices of top k scores
-        top_indices = np.argsort(scores)[::-1][:req.top_k]
-        
+    return index
+
+def overloaded_error(e):
+    return HTTPException(status_code=503, detail="Search service overloaded",
+                         headers={"Retry-After": str(e.retry_after)})
+
+def encode_cached(queries):
+    # Only cache misses go through the model, as one batch; the model sees the cache key text
+    queries = [normalize_query(q) for q in queries]
+    vectors = [query_cache.get(q) for q in queries]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        encoded = normalize_rows(pool.encode_blocking(model.encode, [queries[i] for i in missing]))
+        for i, vector in zip(missing, encoded):
+            query_cache.put(queries[i], vector)
+            vectors[i] = vector
+    return np.stack(vectors)
+
+def select_rows(index, filters):
+    # Rows matching the filters (None = all rows); only these rows get scored
+    if filters is None:
+        return None
+    if index.attributes is None:
+        raise HTTPException(status_code=503, detail="Search service error: Attribute index not loaded")
+    return index.attributes.select(
+        prefectures=filters.prefectures,
+        ranges={
+            'population': (filters.population_min, filters.population_max),
+            'budget': (filters.budget_min, filters.budget_max),
+            'score': (filters.score_min, filters.score_max),
+        },
+    )
+
+def resolve_nprobe(index, nprobe):
+    # Partitions to probe, or None for exact search (no IVF index, or nprobe <= 0)
+    nprobe = IVF_NPROBE if nprobe is None else nprobe
+    if index.ivf is None or nprobe <= 0:
+        return None
+    return nprobe
+
+def score_top_k(index, query_embedding, top_k, rows, timer, nprobe=None):
+    # Cosine Similarity + partial Top K selection, timed separately
+    if nprobe is not None:
+        # Only rows in the nearest IVF partitions (and matching the filters) get scored
+        with timer.stage("probe"):
+            rows = index.ivf.candidates(query_embedding, nprobe, rows)
+    with timer.stage("score"):
+        scores = index.embeddings.scores(query_embedding, rows=rows)
+    with timer.stage("topk"):
+        top_indices = top_k_indices(scores, top_k)
+        top_scores = scores[top_indices]
+        if rows is not None:
+            top_indices = rows[top_indices]
+    return top_indices, top_scores
+
+def search_many(index, queries, top_k, rows, timer, nprobe=None):
+    # One encode batch and one matrix multiply for all queries
+    with timer.stage("encode"):
+        query_embeddings = encode_cached(queries)
+    if nprobe is not None:
+        # Each query probes its own partitions, so the rows are scored per query
         results = []
-        for idx in top_indices:
-            if idx < len(municipality_codes):
-                code = municipality_codes[idx]
-                score = float(scores[idx])
-                info = municipality_data.get(code, {})
-                results.append({
-                    "code": code,
-                    "score": score,
-                    "name": info.get("name", ""),
-                    "prefecture": info.get("prefecture", "")
-                })
-            
+        for query_embedding in query_embeddings:
+            top_indices, top_scores = score_top_k(index, query_embedding, top_k, rows, timer, nprobe)
+            with timer.stage("assemble"):
+                results.append(build_results(index, top_indices, top_scores))
+        return results
+    with timer.stage("score"):
+        scores = index.embeddings.scores(query_embeddings, rows=rows)
+
+    results = []
+    for col in range(scores.shape[1]):
+        column = scores[:, col]
+        with timer.stage("topk"):
+            top_indices = top_k_indices(column, top_k)
+            row_indices = top_indices if rows is None else rows[top_indices]
+        with timer.stage("assemble"):
+            results.append(build_results(index, row_indices, column[top_indices]))
+    return results
+
+@app.post("/search")
+async def search(req: SearchRequest, request: Request):
+    index = check_ready()
+    timer = request.state.timer
+    rows = select_rows(index, req.filters)
+    nprobe = resolve_nprobe(index, req.nprobe)
+    if rows is not None and len(rows) == 0:
+        return {"results": []}
+
+    try:
+        with pool.admit():
+            # Normalized query vector: cached, or encoded together with concurrent requests.
+            # Cache lookups and writes may hit SQLite, so they run on the pool.
+            with timer.stage("encode"):
+                query = normalize_query(req.query)
+                query_embedding = await pool.run(query_cache.get, query)
+                if query_embedding is None:
+                    query_embedding = await encoder.encode(query)
+                    await pool.run(query_cache.put, query, query_embedding)
+
+            top_indices, top_scores = await pool.run(score_top_k, index, query_embedding, req.top_k, rows, timer, nprobe)
+
+        with timer.stage("assemble"):
+            results = build_results(index, top_indices, top_scores)
         return {"results": results}
+    except Overloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
         print(f"Search error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/search/batch")
+async def search_batch(req: BatchSearchRequest, request: Request):
+    index = check_ready()
+    rows = select_rows(index, req.filters)
+    nprobe = resolve_nprobe(index, req.nprobe)
+    # A batch holds one admission slot, so its size is capped like an encode batch
+    if len(req.queries) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH_SIZE} queries per batch")
+    if not req.queries:
+        return {"results": []}
+    if rows is not None and len(rows) == 0:
+        return {"results": [[] for _ in req.queries]}
+
+    try:
+        with pool.admit():
+            results = await pool.run(search_many, index, req.queries, req.top_k, rows, request.state.timer,
+                                     nprobe)
+        return {"results": results}
+    except Overloaded as e:
+        raise overloaded_error(e)
+    except Exception as e:
+        print(f"Batch search error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/similar/{code}")
+def similar(code: str, top_k: int = 5):
+    # Pure lookup in the precomputed neighbour table: no model call, no scoring
+    index = search_index
+    if index is None or index.knn is None:
+        raise HTTPException(status_code=503, detail="Search service error: Neighbour table not loaded")
+    knn = index.knn
+    idx = index.lookup.get(code)
+    if idx is None or idx >= len(knn["indices"]):
+        raise HTTPException(status_code=404, detail=f"Unknown municipality code: {code}")
+    top_k = max(0, min(top_k, knn["indices"].shape[1]))
+    return {
+        "code": code,
+        "results": build_results(index, knn["indices"][idx, :top_k], knn["scores"][idx, :top_k])
+    }
+
+@app.get("/cache/stats")
+def cache_stats():
+    return query_cache.stats() if query_cache is not None else {}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request, x_admin_token: Optional[str] = Header(None)):
+    # Loads new artifacts in the background and swaps them in; the model is not reloaded
+    if ADMIN_TOKEN:
+        if not secrets.compare_digest(x_admin_token or '', ADMIN_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid admin token")
+    elif request.client is None or request.client.host not in LOCAL_HOSTS:
+        raise HTTPException(status_code=403, detail="Admin endpoints need SEARCH_ADMIN_TOKEN for non-local clients")
+    if not await reload_index():
+        raise HTTPException(status_code=409, detail=f"Index reload rejected: {reload_state['last_error']}")
+    return {"index": reload_state, "rows": len(search_index.codes)}
+
+@app.on_event("shutdown")
+async def shutdown():
+    if startup_task is not None and not startup_task.done():
+        startup_task.cancel()
+    if watcher is not None:
+        await watcher.stop()
+    if encoder is not None:
+        await encoder.stop()
+    pool.shutdown()
+    if query_cache is not None:
+        query_cache.close()
+
 @app.get("/health")
 def health():
-    status = "ok" if (model is not None and embeddings is not None) else "loading"
-    return {"status": status}
+    states = [resources[name]["status"] for name in REQUIRED_RESOURCES]
+    if all(state == "ready" for state in states):
+        status = "ok"
+    elif any(state in ("pending", "loading") for state in states):
+        status = "loading"
+    else:
+        status = "degraded"
+    return {"status": status, "resources": resources, "index": reload_state}
@@ -0,0 +1,169 @@
+# Search metadata (codes, names, prefectures, filter indexes, kNN table, IVF lists) as fixed-width
+# NumPy columns aligned to the embedding rows. With SEARCH_SHARED_STORE_DIR set, one uvicorn worker
+# writes them per artifact version to <dir>/<version>/ and every worker memory-maps the same files,
+# so adding workers does not add metadata memory.
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+from scripts.api.attribute_index import AttributeIndex, NUMERIC_COLUMNS
+from scripts.api.ivf_index import IVFIndex
+
+STORE_FORMAT = 3
+
+SearchColumns = namedtuple('SearchColumns', ['codes', 'names', 'prefectures', 'lookup', 'attributes', 'knn',
+                                             'ivf'])
+
+
+class CodeLookup:
+    # code -> row by binary search over the sorted codes; no dict, so it can be memory-mapped
+    def __init__(self, sorted_codes, order):
+        self.sorted_codes = sorted_codes
+        self.order = order
+
+    @classmethod
+    def build(cls, codes):
+        order = np.argsort(codes, kind='stable')
+        return cls(codes[order], order)
+
+    def get(self, code):
+        pos = int(np.searchsorted(self.sorted_codes, code))
+        if pos < len(self.sorted_codes) and self.sorted_codes[pos] == code:
+            return int(self.order[pos])
+        return None
+
+
+def _fixed_width(values):
+    # Fixed-width unicode arrays can be memory-mapped, unlike object arrays
+    values = np.asarray(values, dtype=object)
+    return values.astype(str) if len(values) else np.empty(0, dtype='<U1')
+
+
+def build_columns(codes, table, knn=None, ivf=None):
+    # codes are in embedding row order; table is the cleaned municipality table
+    codes = _fixed_width(codes)
+    names = np.full(len(codes), '', dtype=object)
+    prefectures = np.full(len(codes), '', dtype=object)
+    attributes = None
+    if table is not None:
+        aligned = table.drop_duplicates(subset=['code']).set_index('code').reindex(codes)
+        # astype(object) first: prefecture is categorical when read from the Arrow file
+        names = aligned['name'].astype(object).fillna('').to_numpy(dtype=object)
+        prefectures = aligned['prefecture'].astype(object).fillna('').to_numpy(dtype=object)
+        attributes = AttributeIndex.build(codes, table)
+    return SearchColumns(codes, _fixed_width(names), _fixed_width(prefectures), CodeLookup.build(codes),
+                         attributes, knn, ivf)
+
+
+def store_version(artifact_version):
+    material = json.dumps([STORE_FORMAT, artifact_version], default=str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()[:16]
+
+
+def publish(columns, path):
+    tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(path))
+
+    arrays = {
+        'codes': columns.codes,
+        'names': columns.names,
+        'prefectures': columns.prefectures,
+        'lookup_sorted_codes': columns.lookup.sorted_codes,
+        'lookup_order': columns.lookup.order,
+    }
+    manifest = {'format': STORE_FORMAT, 'rows': len(columns.codes), 'prefectures': [], 'columns': [],
+                'knn': columns.knn is not None, 'ivf': columns.ivf is not None,
+                'attributes': columns.attributes is not None}
+    if columns.knn is not None:
+        manifest['knn_fingerprint'] = columns.knn['fingerprint']
+    if columns.ivf is not None:
+        manifest['ivf_fingerprint'] = columns.ivf.fingerprint
+    if columns.attributes is not None:
+        for i, (prefecture, rows) in enumerate(columns.attributes.prefecture_rows.items()):
+            manifest['prefectures'].append(prefecture)
+            arrays[f'prefecture_{i}'] = rows
+        for column, (order, values) in columns.attributes.sorted_columns.items():
+            manifest['columns'].append(column)
+            arrays[f'{column}_order'] = order
+            arrays[f'{column}_values'] = values
+    if columns.knn is not None:
+        arrays['knn_indices'] = columns.knn['indices']
+        arrays['knn_scores'] = columns.knn['scores']
+    if columns.ivf is not None:
+        arrays['ivf_centroids'] = columns.ivf.centroids
+        arrays['ivf_list_offsets'] = columns.ivf.list_offsets
+        arrays['ivf_list_rows'] = columns.ivf.list_rows
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array))
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def attach(path):
+    with open(os.path.join(path, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest['format'] != STORE_FORMAT:
+        raise ValueError(f"Unsupported shared store format: {manifest['format']}")
+
+    def load(name):
+        return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+
+    codes = load('codes')
+    attributes = None
+    if manifest['attributes']:
+        prefecture_rows = {prefecture: load(f'prefecture_{i}') for i, prefecture in enumerate(manifest['prefectures'])}
+        sorted_columns = {column: (load(f'{column}_order'), load(f'{column}_values'))
+                          for column in manifest['columns'] if column in NUMERIC_COLUMNS}
+        attributes = AttributeIndex(len(codes), prefecture_rows, sorted_columns)
+    knn = None
+    if manifest['knn']:
+        knn = {'indices': load('knn_indices'), 'scores': load('knn_scores'), 'fingerprint': manifest['knn_fingerprint']}
+    ivf = None
+    if manifest['ivf']:
+        ivf = IVFIndex(load('ivf_centroids'), load('ivf_list_offsets'), load('ivf_list_rows'),
+                       manifest['ivf_fingerprint'])
+    return SearchColumns(codes, load('names'), load('prefectures'),
+                         CodeLookup(load('lookup_sorted_codes'), load('lookup_order')), attributes, knn, ivf)
+
+
+def publish_or_attach(store_dir, artifact_version, build_fn):
+    """Attach to the store for artifact_version, building and publishing it with build_fn() first if needed.
+
+    Returns None when build_fn() does (no artifacts).
+    """
+    path = os.path.join(store_dir, store_version(artifact_version))
+    manifest = os.path.join(path, 'manifest.json')
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, '.lock'), 'w') as lock:
+        # Attaching holds a shared lock, so remove_stale() in another worker cannot delete the version meanwhile
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        try:
+            if not os.path.exists(manifest):
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not os.path.exists(manifest):
+                    columns = build_fn()
+                    if columns is None:
+                        return None
+                    publish(columns, path)
+                    print(f"Published shared search store at {path}")
+                    remove_stale(store_dir, keep=os.path.basename(path))
+            return attach(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def remove_stale(store_dir, keep):
+    # Workers that already attached keep their memory maps after the files are deleted
+    for name in os.listdir(store_dir):
+        full_path = os.path.join(store_dir, name)
+        if name != keep and os.path.isdir(full_path):
+            shutil.rmtree(full_path, ignore_errors=True)
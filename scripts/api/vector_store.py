@@ -0,0 +1,224 @@
+"""
+Memory-mapped embedding store with float32, float16 or int8 (per-row symmetric scale) storage.
+
+Check the ranking against exact float32 search on the real data:
+    python -m scripts.api.vector_store check --dtype int8
+"""
+import os
+import fcntl
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+import numpy as np
+
+STORAGE_DTYPES = ('float32', 'float16', 'int8')
+
+# Max absolute cosine score error allowed against exact float32 search;
+# top-k can only reorder candidates whose scores are within this of each other
+RANKING_TOLERANCE = {
+    'float32': 0.0,
+    'float16': 1e-3,
+    'int8': 2e-2,
+}
+
+# Rows scored per block when the stored dtype has to be upcast.
+# Bounds transient memory to SCORE_BLOCK_ROWS * dim * 4 bytes.
+SCORE_BLOCK_ROWS = 16384
+
+_SUFFIX = {'float16': '.f16', 'int8': '.i8'}
+
+
+def derived_dir(path, dtype):
+    # float16/int8 copies live in <root>.f16/ or <root>.i8/, one subdirectory per source version
+    root, _ = os.path.splitext(path)
+    return f"{root}{_SUFFIX[dtype]}"
+
+
+def source_version(path):
+    # The pipeline replaces the source with os.replace, so every rewrite gets a new inode
+    stat = os.stat(path)
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def quantize(vectors, dtype):
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unsupported storage dtype: {dtype}")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == 'float32':
+        return vectors, None
+    if dtype == 'float16':
+        return vectors.astype(np.float16), None
+
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    data = np.rint(vectors / scales[:, None]).clip(-127, 127).astype(np.int8)
+    return data, scales.astype(np.float32)
+
+
+@contextlib.contextmanager
+def _locked(directory):
+    # Serialises builds between processes sharing the directory (e.g. uvicorn workers)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _build_version(path, dtype, target):
+    # Vectors and scales are written to one temporary directory and renamed into place as a pair
+    directory = os.path.dirname(target)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=directory)
+    try:
+        data, scales = quantize(np.load(path, mmap_mode='r'), dtype)
+        np.save(os.path.join(tmp_dir, 'vectors.npy'), data)
+        if scales is not None:
+            np.save(os.path.join(tmp_dir, 'scales.npy'), scales)
+        os.rename(tmp_dir, target)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    # Older versions and leftovers of interrupted builds; memory maps already open stay valid
+    for name in os.listdir(directory):
+        if name not in ('.lock', os.path.basename(target)):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def _open_derived(path, dtype, mmap_mode):
+    directory = derived_dir(path, dtype)
+    with _locked(directory):
+        target = os.path.join(directory, source_version(path))
+        if not os.path.isdir(target):
+            print(f"Building {dtype} vector store at {target}...")
+            _build_version(path, dtype, target)
+        # Opened under the lock, so no other process can remove the version in between
+        vectors = np.load(os.path.join(target, 'vectors.npy'), mmap_mode=mmap_mode)
+        scales_path = os.path.join(target, 'scales.npy')
+        scales = np.load(scales_path, mmap_mode=mmap_mode) if os.path.exists(scales_path) else None
+    return vectors, scales, target
+
+
+def build(path, dtype):
+    if dtype == 'float32':
+        return path
+    return _open_derived(path, dtype, 'r')[2]
+
+
+def top_k_indices(scores, k):
+    # O(N) argpartition, then only the k selected scores are sorted
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class VectorStore:
+    def __init__(self, vectors, scales=None, dtype='float32'):
+        self.vectors = vectors
+        self.scales = scales
+        self.dtype = dtype
+
+    @classmethod
+    def open(cls, path, dtype='float32', mmap=True):
+        # float16/int8 copies are derived from the float32 .npy and rebuilt when it changes
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported storage dtype: {dtype}")
+        mmap_mode = 'r' if mmap else None
+        if dtype == 'float32':
+            return cls(np.load(path, mmap_mode=mmap_mode), dtype=dtype)
+        vectors, scales, _ = _open_derived(path, dtype, mmap_mode)
+        return cls(vectors, scales=scales, dtype=dtype)
+
+    @property
+    def shape(self):
+        return self.vectors.shape
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def scores(self, query, rows=None):
+        # query is (dim,) or (q, dim); with rows, only those rows are scored, in that order
+        query = np.asarray(query, dtype=np.float32)
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        scales = self.scales if (rows is None or self.scales is None) else self.scales[rows]
+
+        if self.dtype == 'float32':
+            return np.dot(vectors, query.T).astype(np.float32, copy=False)
+
+        n = vectors.shape[0]
+        out_shape = (n,) if query.ndim == 1 else (n, query.shape[0])
+        out = np.empty(out_shape, dtype=np.float32)
+        for start in range(0, n, SCORE_BLOCK_ROWS):
+            stop = min(start + SCORE_BLOCK_ROWS, n)
+            block = np.dot(vectors[start:stop].astype(np.float32), query.T)
+            if scales is not None:
+                block *= scales[start:stop] if query.ndim == 1 else scales[start:stop, None]
+            out[start:stop] = block
+        return out
+
+    def top_k(self, query, k, rows=None):
+        scores = self.scores(query, rows=rows)
+        indices = top_k_indices(scores, k)
+        top_scores = scores[indices]
+        if rows is not None:
+            indices = np.asarray(rows)[indices]
+        return indices, top_scores
+
+
+def compare_ranking(exact, store, queries, k):
+    exact_scores = exact.scores(queries)
+    approx_scores = store.scores(queries)
+    recalls = []
+    for col in range(queries.shape[0]):
+        expected = set(top_k_indices(exact_scores[:, col], k).tolist())
+        got = set(top_k_indices(approx_scores[:, col], k).tolist())
+        recalls.append(len(expected & got) / max(len(expected), 1))
+    return {
+        'dtype': store.dtype,
+        'k': k,
+        'queries': int(queries.shape[0]),
+        'recall_at_k': float(np.mean(recalls)),
+        'max_abs_score_error': float(np.abs(exact_scores - approx_scores).max()),
+        'tolerance': RANKING_TOLERANCE[store.dtype],
+    }
+
+
+def main():
+    default_path = os.path.join(os.path.dirname(__file__), '../../data/cleaned/municipality_embeddings.npy')
+    parser = argparse.ArgumentParser(description="Build or check quantized vector stores.")
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--dtype', choices=STORAGE_DTYPES, default='int8')
+    parser.add_argument('--path', default=default_path)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        print(f"Built {build(args.path, args.dtype)}")
+        return
+
+    exact = VectorStore.open(args.path, 'float32')
+    store = VectorStore.open(args.path, args.dtype)
+    # Use stored municipalities themselves as probe queries
+    rng = np.random.default_rng(42)
+    probe = rng.choice(len(exact), size=min(args.queries, len(exact)), replace=False)
+    queries = np.asarray(exact.vectors[np.sort(probe)], dtype=np.float32)
+    result = compare_ranking(exact, store, queries, args.top_k)
+    print(result)
+    if result['max_abs_score_error'] > result['tolerance']:
+        raise SystemExit(f"Score error exceeds tolerance for {args.dtype}")
+
+
+if __name__ == '__main__':
+    main()
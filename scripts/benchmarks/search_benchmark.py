@@ -0,0 +1,306 @@
+"""
+In-process benchmark for search_server.py (ASGI, no HTTP server) on synthetic corpora of 1k-1M rows:
+startup time, latency percentiles, throughput per concurrency level, and peak RSS. Each corpus is generated in one
+child process and served in a fresh one, so peak RSS covers the server only.
+The encoder is a stub returning a fixed vector per query; --encode-ms simulates model latency.
+
+Usage:
+    python -m scripts.benchmarks.search_benchmark run --rows 1000 10000 100000 1000000
+    python -m scripts.benchmarks.search_benchmark run --rows 10000 --concurrency 1 8 32 --dtype int8
+    python -m scripts.benchmarks.search_benchmark compare data/benchmarks/search_a.json data/benchmarks/search_b.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import asyncio
+import itertools
+import argparse
+import resource
+import subprocess
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+RESULTS_DIR = os.path.join(REPO_ROOT, 'data/benchmarks')
+
+DEFAULT_ROWS = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_CONCURRENCY = [1, 8, 32]
+DEFAULT_DIM = 768  # pkshatech/GLuCoSE-base-ja
+CORPUS_BLOCK_ROWS = 65536
+
+PREFECTURES = ['北海道', '東京都', '京都府', '大阪府', '福岡県', '沖縄県']
+
+
+class StubEncoder:
+    def __init__(self, dim, encode_ms=0.0):
+        self.dim = dim
+        self.encode_ms = encode_ms
+
+    def encode(self, texts, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if self.encode_ms:
+            time.sleep(self.encode_ms / 1000.0)
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            out[i] = np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(self.dim)
+        out /= np.linalg.norm(out, axis=1, keepdims=True)
+        return out[0] if single else out
+
+
+def corpus_paths(out_dir):
+    return {
+        'embeddings': os.path.join(out_dir, 'municipality_embeddings.npy'),
+        'mapping': os.path.join(out_dir, 'municipality_embedding_map.json'),
+        'metadata': os.path.join(out_dir, 'municipalities_cleaned.csv'),
+        'metadata_arrow': os.path.join(out_dir, 'municipalities_cleaned.arrow'),
+    }
+
+
+def make_corpus(out_dir, rows, dim, seed=42):
+    # Embeddings are written block by block into a memmap, so 1M rows are never held in memory
+    os.makedirs(out_dir, exist_ok=True)
+    paths = corpus_paths(out_dir)
+    rng = np.random.default_rng(seed)
+    vectors = np.lib.format.open_memmap(paths['embeddings'], mode='w+', dtype=np.float32, shape=(rows, dim))
+    for start in range(0, rows, CORPUS_BLOCK_ROWS):
+        stop = min(start + CORPUS_BLOCK_ROWS, rows)
+        block = rng.standard_normal((stop - start, dim), dtype=np.float32)
+        vectors[start:stop] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    vectors.flush()
+    del vectors
+
+    codes = np.char.zfill(np.arange(rows).astype(str), 7)
+    with open(paths['mapping'], 'w', encoding='utf-8') as f:
+        json.dump({code: idx for idx, code in enumerate(codes.tolist())}, f)
+
+    table = pd.DataFrame({
+        'code': codes,
+        'name': np.char.add('自治体', codes),
+        'prefecture': pd.Categorical(rng.choice(PREFECTURES, size=rows)),
+        'population': rng.lognormal(10.5, 1.2, size=rows).astype(int),
+        'budget': rng.lognormal(9.5, 1.2, size=rows).astype(int),
+        'score': rng.uniform(0, 100, size=rows).round(2),
+    })
+    # Same layout as transform_data.py: CSV plus the uncompressed Arrow file the server reads
+    table.to_csv(paths['metadata'], index=False)
+    table.to_feather(paths['metadata_arrow'], compression='uncompressed')
+    return paths
+
+
+def percentiles(samples):
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) if len(values) else (np.nan,) * 3
+    return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3), 'p99_ms': round(float(p99), 3)}
+
+
+async def wait_until_ready(client, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        health = (await client.get('/health')).json()
+        if health['status'] in ('ok', 'degraded'):
+            return time.perf_counter() - start, health
+        await asyncio.sleep(0.01)
+    raise TimeoutError(f"Search service not ready after {timeout}s")
+
+
+async def drive(client, concurrency, requests, top_k, path, make_body):
+    latencies = []
+    failures = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal failures
+        for i in counter:
+            start = time.perf_counter()
+            response = await client.post(path, json=make_body(i, top_k))
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return dict(percentiles(latencies), requests=requests, failures=failures,
+                throughput_rps=round(requests / elapsed, 2) if elapsed else None)
+
+
+async def benchmark_server(paths, dim, args):
+    import httpx
+    from scripts.api import search_server
+
+    search_server.EMBEDDINGS_PATH = paths['embeddings']
+    search_server.METADATA_PATH = paths['mapping']
+    search_server.MUNICIPALITIES_CSV = paths['metadata']
+    search_server.MUNICIPALITIES_ARROW = paths['metadata_arrow']
+    search_server.KNN_PATH = os.path.join(os.path.dirname(paths['embeddings']), 'missing_knn.npz')
+    search_server.IVF_PATH = os.path.join(os.path.dirname(paths['embeddings']), 'missing_ivf.npz')
+    search_server.HASHES_PATH = os.path.join(os.path.dirname(paths['embeddings']), 'missing_hashes.json')
+    search_server.VECTOR_DTYPE = args.dtype
+    search_server.CACHE_PATH = ''
+    search_server.read_model = lambda: StubEncoder(dim, args.encode_ms)
+
+    transport = httpx.ASGITransport(app=search_server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+        start = time.perf_counter()
+        await search_server.load_data()
+        _, health = await wait_until_ready(client, args.timeout)
+        result = {
+            'startup_seconds': round(time.perf_counter() - start, 3),
+            'resources': {name: state.get('load_seconds') for name, state in health['resources'].items()},
+            'search': {},
+            'search_batch': {},
+        }
+
+        # Unique query per request across all runs, so the query cache never short-circuits the encoder
+        query_ids = itertools.count()
+
+        def search_body(i, top_k):
+            return {'query': f'ベンチマーク {next(query_ids)}', 'top_k': top_k}
+
+        def batch_body(i, top_k):
+            return {'queries': [f'ベンチマーク {next(query_ids)}' for _ in range(args.batch_size)], 'top_k': top_k}
+
+        await drive(client, 1, args.warmup, args.top_k, '/search', search_body)
+        for concurrency in args.concurrency:
+            result['search'][str(concurrency)] = await drive(
+                client, concurrency, args.requests, args.top_k, '/search', search_body)
+            print(f"  /search c={concurrency}: {result['search'][str(concurrency)]}")
+        for concurrency in args.concurrency:
+            result['search_batch'][str(concurrency)] = await drive(
+                client, concurrency, max(args.requests // args.batch_size, 1), args.top_k,
+                '/search/batch', batch_body)
+
+        await search_server.shutdown()
+    return result
+
+
+def run_single(args):
+    # Child process serving the corpus another child wrote to args.corpus_dir; the result JSON is the
+    # last line of stdout
+    result = asyncio.run(benchmark_server(corpus_paths(args.corpus_dir), args.dim, args))
+    result.update({
+        'rows': args.single,
+        # ru_maxrss is reported in KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+    })
+    print(json.dumps(result))
+
+
+def run_child(*args):
+    return subprocess.run([sys.executable, '-m', 'scripts.benchmarks.search_benchmark', 'run', *args],
+                          cwd=REPO_ROOT, capture_output=True, text=True)
+
+
+def child_error(child):
+    print(child.stdout[-2000:], child.stderr[-2000:])
+    return child.stderr.strip().splitlines()[-1:]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args):
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {
+            'dim': args.dim, 'dtype': args.dtype, 'top_k': args.top_k, 'requests': args.requests,
+            'concurrency': args.concurrency, 'batch_size': args.batch_size, 'encode_ms': args.encode_ms,
+        },
+        'corpora': [],
+    }
+    passthrough = [
+        '--dim', str(args.dim), '--dtype', args.dtype, '--top-k', str(args.top_k),
+        '--requests', str(args.requests), '--warmup', str(args.warmup), '--batch-size', str(args.batch_size),
+        '--encode-ms', str(args.encode_ms), '--timeout', str(args.timeout),
+        '--concurrency', *[str(c) for c in args.concurrency],
+    ]
+    for rows in args.rows:
+        print(f"[{rows} rows] running...")
+        with tempfile.TemporaryDirectory(prefix='search-bench-') as tmp_dir:
+            start = time.perf_counter()
+            child = run_child('--make-corpus', str(rows), '--corpus-dir', tmp_dir, '--dim', str(args.dim))
+            corpus_seconds = time.perf_counter() - start
+            if child.returncode == 0:
+                child = run_child('--single', str(rows), '--corpus-dir', tmp_dir, *passthrough)
+        if child.returncode != 0:
+            report['corpora'].append({'rows': rows, 'error': child_error(child)})
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        result['corpus_seconds'] = round(corpus_seconds, 3)
+        report['corpora'].append(result)
+        print(f"[{rows} rows] startup {result['startup_seconds']}s, peak RSS {result['peak_rss_mb']} MB")
+
+    output = args.output or os.path.join(RESULTS_DIR, f'search_{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Saved results to {output}")
+
+
+def compare(args):
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = {c['rows']: c for c in json.load(f)['corpora'] if 'error' not in c}
+    with open(args.candidate, 'r', encoding='utf-8') as f:
+        candidate = {c['rows']: c for c in json.load(f)['corpora'] if 'error' not in c}
+
+    print(f"{'rows':>9} {'endpoint':>13} {'conc':>5} {'p95 ms':>19} {'rps':>21} {'rss MB':>17}")
+    for rows in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[rows], candidate[rows]
+        for endpoint in ('search', 'search_batch'):
+            for concurrency in sorted(set(before[endpoint]) & set(after[endpoint]), key=int):
+                b, a = before[endpoint][concurrency], after[endpoint][concurrency]
+                print(f"{rows:>9} {endpoint:>13} {concurrency:>5} "
+                      f"{b['p95_ms']:>8.2f} -> {a['p95_ms']:>8.2f} "
+                      f"{b['throughput_rps']:>9.1f} -> {a['throughput_rps']:>9.1f} "
+                      f"{before['peak_rss_mb']:>7.0f} -> {after['peak_rss_mb']:>7.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the semantic search service in-process.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run', help="Run the benchmark over synthetic corpora")
+    run_parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    run_parser.add_argument('--concurrency', type=int, nargs='+', default=DEFAULT_CONCURRENCY)
+    run_parser.add_argument('--dim', type=int, default=DEFAULT_DIM)
+    run_parser.add_argument('--dtype', choices=['float32', 'float16', 'int8'], default='float32')
+    run_parser.add_argument('--top-k', type=int, default=10)
+    run_parser.add_argument('--requests', type=int, default=200, help="Requests per concurrency level")
+    run_parser.add_argument('--warmup', type=int, default=10)
+    run_parser.add_argument('--batch-size', type=int, default=16, help="Queries per /search/batch request")
+    run_parser.add_argument('--encode-ms', type=float, default=0.0, help="Simulated model time per encode call")
+    run_parser.add_argument('--timeout', type=float, default=600.0, help="Seconds to wait for startup")
+    run_parser.add_argument('--output', help="Results JSON (default: data/benchmarks/search_<commit>.json)")
+    run_parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    run_parser.add_argument('--make-corpus', type=int, help=argparse.SUPPRESS)
+    run_parser.add_argument('--corpus-dir', help=argparse.SUPPRESS)
+
+    compare_parser = sub.add_parser('compare', help="Compare two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        compare(args)
+    elif args.make_corpus:
+        make_corpus(args.corpus_dir, args.make_corpus, args.dim)
+    elif args.single:
+        run_single(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Streaming e-Stat census parser.
+
+Reads the long-format CSV (@cat01,@cat02,@cat03,@area,@time,@unit,$) in fixed-dtype chunks, filters
+categories and periods, converts units to persons and builds an area x period population matrix.
+Only the filtered matrix is held in memory.
+
+Usage:
+    python scripts/data_migration/census_parser.py
+    python scripts/data_migration/census_parser.py --times 1801 1901 --chunksize 500000
+"""
+import os
+import argparse
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), '../../data/source')
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), '../../data/cleaned')
+
+CENSUS_CSV = os.path.join(SOURCE_DIR, 'census_population.csv')
+MATRIX_CSV = os.path.join(OUTPUT_DIR, 'census_population_matrix.csv')
+
+CHUNK_ROWS = 200_000
+
+# Total population (all sexes, all ages)
+TOTAL_POPULATION = {'@cat01': '001', '@cat02': '001', '@cat03': '01000'}
+
+# Multipliers to persons. Rows in other units (e.g. 女性＝100 sex ratios) are skipped.
+UNIT_SCALE = {
+    '人': 1,
+    '千人': 1_000,
+    '万人': 10_000,
+    '百万人': 1_000_000,
+}
+
+CENSUS_COLUMNS = ['@cat01', '@cat02', '@cat03', '@area', '@time', '@unit', '$']
+
+CensusMatrix = namedtuple('CensusMatrix', ['areas', 'periods', 'values', 'stats'])
+
+
+def _grow(matrix, rows, cols):
+    # Grows the matrix to at least rows x cols (rows double); new cells are NaN
+    if rows <= matrix.shape[0] and cols <= matrix.shape[1]:
+        return matrix
+    new_rows = max(rows, matrix.shape[0] * 2) if rows > matrix.shape[0] else matrix.shape[0]
+    grown = np.full((new_rows, max(cols, matrix.shape[1])), np.nan)
+    grown[:matrix.shape[0], :matrix.shape[1]] = matrix
+    return grown
+
+
+def _positions(keys, index):
+    # Position of each key in index, appending unseen keys
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    positions = np.array([index.setdefault(key, len(index)) for key in uniques], dtype=np.int64)
+    return positions[inverse]
+
+
+def parse_census(path=CENSUS_CSV, categories=TOTAL_POPULATION, times=None, chunksize=CHUNK_ROWS):
+    # categories filters on {column: code}, times on @time codes (None = all).
+    # A repeated (area, period) keeps the last value.
+    area_index = {}
+    period_index = {}
+    matrix = np.full((0, 0), np.nan)
+    stats = {'rows': 0, 'matched': 0, 'skipped_unit': 0, 'invalid_value': 0}
+    times = set(times) if times is not None else None
+
+    reader = pd.read_csv(path, usecols=CENSUS_COLUMNS, dtype=str, keep_default_na=False,
+                         encoding='utf-8-sig', chunksize=chunksize)
+    for chunk in reader:
+        stats['rows'] += len(chunk)
+        mask = np.ones(len(chunk), dtype=bool)
+        for column, code in categories.items():
+            mask &= (chunk[column] == code).to_numpy()
+        if times is not None:
+            mask &= chunk['@time'].isin(times).to_numpy()
+
+        scale = chunk['@unit'].map(UNIT_SCALE).to_numpy(dtype=np.float64, na_value=np.nan)
+        unknown_unit = mask & np.isnan(scale)
+        stats['skipped_unit'] += int(unknown_unit.sum())
+        mask &= ~unknown_unit
+
+        # e-Stat marks missing cells with '-', '…', '***' etc.
+        values = pd.to_numeric(chunk['$'].to_numpy()[mask], errors='coerce') * scale[mask]
+        valid = ~np.isnan(values)
+        stats['invalid_value'] += int((~valid).sum())
+        stats['matched'] += int(valid.sum())
+        if not valid.any():
+            continue
+
+        rows = _positions(chunk['@area'].to_numpy()[mask][valid], area_index)
+        cols = _positions(chunk['@time'].to_numpy()[mask][valid], period_index)
+        matrix = _grow(matrix, len(area_index), len(period_index))
+        matrix[rows, cols] = values[valid]
+
+    areas = np.array(list(area_index), dtype=object)
+    periods = np.array(list(period_index), dtype=object)
+    values = matrix[:len(areas), :len(periods)]
+
+    # Present areas and periods in code order
+    area_order = np.argsort(areas.astype(str), kind='stable')
+    period_order = np.argsort(periods.astype(str), kind='stable')
+    return CensusMatrix(areas[area_order], periods[period_order],
+                        values[np.ix_(area_order, period_order)], stats)
+
+
+def latest_population(census):
+    # Latest period with a value per area, as area / period / population
+    valid = ~np.isnan(census.values)
+    has_value = valid.any(axis=1)
+    last = census.values.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1) if valid.size else np.zeros(0, int)
+    rows = np.flatnonzero(has_value)
+    return pd.DataFrame({
+        'area': census.areas[rows],
+        'period': census.periods[last[rows]],
+        'population': census.values[rows, last[rows]],
+    })
+
+
+def to_frame(census):
+    df = pd.DataFrame(census.values, index=pd.Index(census.areas, name='area'), columns=census.periods)
+    return df.reset_index()
+
+
+def write_matrix(census, path=MATRIX_CSV):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    to_frame(census).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    print(f"Saved {len(census.areas)} areas x {len(census.periods)} periods to {path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parse the e-Stat census CSV into an area x period matrix.")
+    parser.add_argument('--input', default=CENSUS_CSV)
+    parser.add_argument('--output', default=MATRIX_CSV)
+    parser.add_argument('--times', nargs='*', help="@time codes to keep (default: all)")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    result = parse_census(args.input, times=args.times, chunksize=args.chunksize)
+    print(result.stats)
+    write_matrix(result, args.output)
@@ -0,0 +1,66 @@
+# Columnar artifact for the cleaned municipality table.
+# transform_data.py also writes municipalities_cleaned.csv as municipalities_cleaned.arrow (uncompressed
+# Arrow IPC / Feather v2) with fixed types: code / name string, population / budget int64, score float64,
+# prefecture / category dictionary-encoded. Being uncompressed, it can be memory-mapped and single columns
+# read without type inference. Readers fall back to the CSV, which is kept for the DB load and for review.
+import os
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+CLEANED_DIR = os.path.join(os.path.dirname(__file__), '../../data/cleaned')
+CLEANED_CSV = os.path.join(CLEANED_DIR, 'municipalities_cleaned.csv')
+CLEANED_ARROW = os.path.join(CLEANED_DIR, 'municipalities_cleaned.arrow')
+
+SCHEMA = pa.schema([
+    ('code', pa.string()),
+    ('name', pa.string()),
+    ('prefecture', pa.dictionary(pa.int32(), pa.string())),
+    ('population', pa.int64()),
+    ('budget', pa.int64()),
+    ('score', pa.float64()),
+    ('category', pa.dictionary(pa.int32(), pa.string())),
+])
+
+# Fixed dtypes for the CSV fallback, so no column is type-inferred
+CSV_DTYPES = {'code': str, 'name': str, 'prefecture': 'category', 'category': 'category'}
+
+
+def to_table(df):
+    # DataFrame -> pyarrow.Table with SCHEMA's types and column order
+    df = df[SCHEMA.names].copy()
+    df['code'] = df['code'].astype(str)
+    for column in ('prefecture', 'category'):
+        df[column] = df[column].astype('category')
+    return pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+
+
+def write(df, path=CLEANED_ARROW):
+    # Uncompressed Arrow IPC, replaced through a temporary file
+    tmp_path = f"{path}.tmp"
+    feather.write_feather(to_table(df), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_arrow(columns=None, path=CLEANED_ARROW):
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+
+def count_rows(arrow_path=CLEANED_ARROW, csv_path=CLEANED_CSV):
+    # Row count; for the Arrow file only the record batch lengths are read
+    if os.path.exists(arrow_path):
+        with pa.memory_map(arrow_path) as source:
+            reader = pa.ipc.open_file(source)
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    return len(pd.read_csv(csv_path, usecols=['code'], dtype=str))
+
+
+def read(columns=None, arrow_path=CLEANED_ARROW, csv_path=CLEANED_CSV):
+    # Selected columns as a DataFrame, from the Arrow file or else the CSV
+    if os.path.exists(arrow_path):
+        return read_arrow(columns, arrow_path).to_pandas()
+    usecols = None if columns is None else (lambda c: c in columns)
+    df = pd.read_csv(csv_path, usecols=usecols, dtype=CSV_DTYPES)
+    return df if columns is None else df[[c for c in columns if c in df.columns]]
@@ -1,17 +1,56 @@
 # create_indexes.py
-import psycopg2
-import os
+# Index definitions for the migrated tables.
+# Indexes are built after the load: load_database.py calls build_indexes() once COPY into the staging
+# tables is done, and rename_indexes() moves them to their final names at the swap. Run on its own, it only
+# creates the indexes missing from the live tables.
+from db import connect
+
+# table -> [(index name, definition)]; {name} / {table} are filled per build
+INDEXES = {
+    'municipalities': [
+        ('municipalities_pkey', 'ALTER TABLE {table} ADD CONSTRAINT {name} PRIMARY KEY (id)'),
+        ('municipalities_code_key', 'ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE (code)'),
+        # Cache strategy lookups: ranking by score, filtering by population / prefecture
+        ('idx_municipalities_score', 'CREATE INDEX {name} ON {table} (score)'),
+        ('idx_municipalities_population', 'CREATE INDEX {name} ON {table} (population)'),
+        ('idx_municipalities_prefecture', 'CREATE INDEX {name} ON {table} (prefecture)'),
+    ],
+    'municipality_embeddings': [
+        ('municipality_embeddings_pkey', 'ALTER TABLE {table} ADD CONSTRAINT {name} PRIMARY KEY (code)'),
+    ],
+}
+
+
+def build_indexes(cur, table, target=None, suffix=''):
+    # Creates the indexes for target (default: table) on table, with suffix appended to their names
+    for name, definition in INDEXES[target or table]:
+        cur.execute(definition.format(table=table, name=f"{name}{suffix}"))
+
+
+def rename_indexes(cur, target, suffix, new_suffix='', if_exists=False):
+    # Renames the indexes (and constraints) of target from {name}{suffix} to {name}{new_suffix}
+    if_exists = 'IF EXISTS ' if if_exists else ''
+    for name, _ in INDEXES[target]:
+        cur.execute(f"ALTER INDEX {if_exists}{name}{suffix} RENAME TO {name}{new_suffix}")
 
-# Placeholder for index creation logic
-# This script will connect to the DB and execute CREATE INDEX statements
-# tailored for the cache strategy (e.g., indexes on score, population)
 
 def create_indexes():
     print("Connecting to DB to create indexes...")
-    # conn = psycopg2.connect(...)
-    # cur = conn.cursor()
-    # cur.execute("CREATE INDEX idx_municipalities_score ON municipalities (score);")
-    # ...
+    conn = connect()
+    try:
+        with conn, conn.cursor() as cur:
+            for table, indexes in INDEXES.items():
+                cur.execute("SELECT to_regclass(%s)", (table,))
+                if cur.fetchone()[0] is None:
+                    print(f" Skipped {table} (table not found)")
+                    continue
+                for name, definition in indexes:
+                    cur.execute("SELECT to_regclass(%s)", (name,))
+                    if cur.fetchone()[0] is None:
+                        cur.execute(definition.format(table=table, name=name))
+                        print(f" Created {name}")
+    finally:
+        conn.close()
     print(" Indexes created.")
 
 if __name__ == '__main__':
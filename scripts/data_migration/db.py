@@ -0,0 +1,20 @@
+# PostgreSQL connection for the data migration scripts. Uses the same variables as the script-runner service
+# in docker-compose (POSTGRES_HOST / POSTGRES_PORT / POSTGRES_USER / POSTGRES_PASSWORD / POSTGRES_DB);
+# POSTGRES_URL takes precedence. Locally: `docker compose up -d postgres`, then POSTGRES_HOST=localhost.
+import os
+
+
+def connect():
+    # Imported here, so the SQL-building helpers load (and are testable) without the driver installed
+    import psycopg2
+
+    url = os.getenv('POSTGRES_URL')
+    if url:
+        return psycopg2.connect(url)
+    return psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST', 'localhost'),
+        port=int(os.getenv('POSTGRES_PORT', '5432')),
+        user=os.getenv('POSTGRES_USER', 'user'),
+        password=os.getenv('POSTGRES_PASSWORD', 'pass'),
+        dbname=os.getenv('POSTGRES_DB', 'localgov'),
+    )
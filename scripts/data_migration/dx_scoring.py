@@ -0,0 +1,147 @@
+"""
+Vectorized DX Progress Scoring.
+
+Loads the Digital Agency DX progress CSVs (item x municipality, transposed) as NumPy arrays and
+scores every municipality without a row loop.
+
+Sheets: the municipal / prefectural comparison sheets (実施 / 未実施 flags and xx% rates) and the
+online application rate sheets (xx% per procedure).
+
+Scores:
+- implemented_share: share of all items that are 実施 (the old transform_data.py score)
+- completion_rate: share of 実施 among answered flag items
+- mean_rate: mean of answered xx% items
+- weighted_score: weighted mean (実施=1, 未実施=0, xx%=xx/100, blanks excluded)
+"""
+import os
+import json
+import argparse
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), '../../data/source')
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), '../../data/cleaned')
+
+DX_SHEETS = {
+    'municipal_comparison': '市区町村毎のDX進捗状況_市区町村比較.csv',
+    'prefectural_comparison': '都道府県のDX進捗状況_都道府県比較.csv',
+    'municipal_online_rate': '市区町村毎のDX進捗状況_行政手続のオンライン申請率.csv',
+    'prefectural_online_rate': '都道府県のDX進捗状況_行政手続のオンライン申請率.csv',
+}
+
+DONE = '実施'
+NOT_DONE = '未実施'
+
+# Item kinds, decided per item (row of the source sheet) from its answers
+KIND_FLAG = 'flag'    # 実施 / 未実施
+KIND_RATE = 'rate'    # xx%
+KIND_COUNT = 'count'  # plain numbers (e.g. denominators), not scored
+
+DXMatrix = namedtuple('DXMatrix', ['entities', 'categories', 'items', 'cells'])
+DXValues = namedtuple('DXValues', ['values', 'kinds', 'done', 'answered'])
+
+
+def load_dx_matrix(path):
+    # Read a DX progress CSV into a municipality x item string matrix (DXMatrix)
+    raw = pd.read_csv(path, header=None, dtype=str, keep_default_na=False).to_numpy()
+    entities = np.char.strip(raw[0, 2:].astype(str))
+    categories = raw[1:, 0]
+    items = raw[1:, 1]
+    # Source is item-major; transpose once so rows are municipalities/prefectures
+    cells = np.char.strip(raw[1:, 2:].T.astype(str))
+    return DXMatrix(entities, categories, items, cells)
+
+
+def parse_values(matrix):
+    # Convert the string matrix to numbers and classify each item:
+    # 実施=1.0, 未実施=0.0, 'xx%'=xx/100, numbers as-is, blank=NaN
+    cells = matrix.cells
+    done = cells == DONE
+    not_done = cells == NOT_DONE
+    is_rate = np.char.endswith(cells, '%')
+
+    numeric = pd.to_numeric(pd.Series(np.char.rstrip(cells, '%').ravel()), errors='coerce')
+    values = numeric.to_numpy(dtype=np.float64, copy=True).reshape(cells.shape)
+    values[is_rate] /= 100.0
+    values[done] = 1.0
+    values[not_done] = 0.0
+
+    flags = (done | not_done).any(axis=0)
+    rates = is_rate.any(axis=0)
+    kinds = np.where(flags, KIND_FLAG, np.where(rates, KIND_RATE, KIND_COUNT))
+    answered = ~np.isnan(values)
+    return DXValues(values, kinds, done, answered)
+
+
+def item_weights(matrix, kinds, weights=None):
+    # Per-item weight vector. weights maps item or kind name to a weight (item wins);
+    # unlisted flag/rate items get 1.0, count items 0.0
+    weights = weights or {}
+    default = np.where(kinds == KIND_COUNT, 0.0, 1.0)
+    return np.array([
+        weights.get(item, weights.get(category, fallback))
+        for item, category, fallback in zip(matrix.items, matrix.categories, default)
+    ], dtype=np.float64)
+
+
+def _safe_ratio(numerator, denominator):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def score_matrix(matrix, weights=None):
+    # Score every municipality at once; returns a per-municipality DataFrame (values 0-100)
+    parsed = parse_values(matrix)
+    values, kinds, answered = parsed.values, parsed.kinds, parsed.answered
+    n_items = values.shape[1]
+
+    flag_cols = kinds == KIND_FLAG
+    rate_cols = kinds == KIND_RATE
+    filled = np.where(answered, values, 0.0)
+
+    implemented_share = parsed.done.sum(axis=1) / n_items if n_items else np.zeros(len(values))
+    completion_rate = _safe_ratio(filled[:, flag_cols].sum(axis=1), answered[:, flag_cols].sum(axis=1))
+    mean_rate = _safe_ratio(filled[:, rate_cols].sum(axis=1), answered[:, rate_cols].sum(axis=1))
+
+    w = item_weights(matrix, kinds, weights)
+    weighted_score = _safe_ratio(filled @ w, answered @ w)
+
+    return pd.DataFrame({
+        'entity': matrix.entities,
+        'implemented_share': implemented_share * 100,
+        'completion_rate': completion_rate * 100,
+        'mean_rate': mean_rate * 100,
+        'weighted_score': weighted_score * 100,
+    })
+
+
+def score_all_sheets(source_dir=SOURCE_DIR, weights=None):
+    # Scores for every DX sheet as {sheet: DataFrame}; missing sheets are skipped
+    scores = {}
+    for key, filename in DX_SHEETS.items():
+        path = os.path.join(source_dir, filename)
+        if os.path.exists(path):
+            scores[key] = score_matrix(load_dx_matrix(path), weights)
+    return scores
+
+
+def write_scores(scores, output_dir=OUTPUT_DIR):
+    # Write each sheet to dx_scores_<sheet>.csv
+    os.makedirs(output_dir, exist_ok=True)
+    for key, df in scores.items():
+        path = os.path.join(output_dir, f'dx_scores_{key}.csv')
+        df.round(4).to_csv(path, index=False)
+        print(f"Saved {len(df)} rows to {path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score all DX progress sheets.")
+    parser.add_argument('--weights', help="JSON file of {item or category: weight}")
+    args = parser.parse_args()
+    item_weight_map = None
+    if args.weights:
+        with open(args.weights, 'r', encoding='utf-8') as f:
+            item_weight_map = json.load(f)
+    write_scores(score_all_sheets(weights=item_weight_map))
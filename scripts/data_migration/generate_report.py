@@ -1,35 +1,94 @@
 import json
 import os
-import pandas as pd
 
-CLEANED_CSV = os.path.join(os.path.dirname(__file__), '../../data/cleaned/municipalities_cleaned.csv')
+import cleaned_table
+
 REPORT_FILE = 'migration_verification_report.json'
+VALIDATION_REPORT = 'validation_report.json'  # written by validate_source_data.py
+SCHEMA_MAPPING = 'schema_mapping.yaml'  # written by create_schema_mapping.py
+DB_IMPORT_REPORT = 'db_import_report.json'  # written by load_database.py
+# Manifest of the pipeline run this report belongs to (set by scripts/run_pipeline.py);
+# the latest run when the script is run on its own
+RUN_MANIFEST = os.getenv('PIPELINE_RUN_MANIFEST',
+                         os.path.join(os.path.dirname(__file__), '../../data/profiles/latest.json'))
+
+def read_json(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (ValueError, OSError):
+        return None
+
+def stage_failed(manifest, stage):
+    # A stage that crashed may have left the previous run's outputs behind
+    status = (manifest or {}).get('stages', {}).get(stage, {}).get('status')
+    return status in ('failed', 'blocked')
+
+def step_statuses(manifest):
+    # Step status from the files each step writes and the latest run manifest
+    validation = read_json(VALIDATION_REPORT)
+    cleaned = os.path.exists(cleaned_table.CLEANED_ARROW) or os.path.exists(cleaned_table.CLEANED_CSV)
+    db_import = read_json(DB_IMPORT_REPORT)
+    steps = {
+        'validation': validation['status'] if validation else 'pending',
+        'schema_mapping': 'success' if os.path.exists(SCHEMA_MAPPING) else 'pending',
+        'transformation': 'success' if cleaned else 'pending',
+        'db_import': db_import['status'] if db_import else 'pending',
+    }
+    if stage_failed(manifest, 'validate'):
+        steps['validation'] = 'failure'
+    if stage_failed(manifest, 'transform'):
+        steps['transformation'] = 'failure'
+    return steps, db_import
+
+def pipeline_summary(manifest):
+    # Status, timings and peak RSS per stage from the run manifest
+    stages = {}
+    for name, stage in manifest.get('stages', {}).items():
+        # The report stage itself is still running
+        if stage.get('status') == 'running':
+            continue
+        stages[name] = {key: stage[key] for key in ('status', 'wall_s', 'cpu_s', 'peak_rss_mb') if key in stage}
+    return {'run_id': manifest.get('run_id'), 'commit': manifest.get('commit'), 'stages': stages}
 
 def generate_report():
+    manifest = read_json(RUN_MANIFEST)
+    steps, db_import = step_statuses(manifest)
+    if any(status == 'failure' for status in steps.values()):
+        status = 'failure'
+    elif all(status == 'success' for status in steps.values()):
+        status = 'success'
+    else:
+        status = 'partial_success'
+
     report = {
-        'status': 'partial_success',
-        'steps': {
-            'validation': 'success',
-            'schema_mapping': 'success',
-            'transformation': 'success',
-            'db_import': 'pending'
-        },
+        'status': status,
+        'steps': steps,
         'metrics': {
              'cleaned_records': 0
         }
     }
-    
-    if os.path.exists(CLEANED_CSV):
+
+    if steps['transformation'] != 'pending':
         try:
-            df = pd.read_csv(CLEANED_CSV)
-            report['metrics']['cleaned_records'] = len(df)
-        except:
+            # Row count from the Arrow batch metadata; no column is read
+            report['metrics']['cleaned_records'] = cleaned_table.count_rows()
+        except Exception:
             report['metrics']['cleaned_records'] = -1
-    
+
+    if db_import:
+        for table, info in db_import.get('tables', {}).items():
+            report['metrics'][f'{table}_loaded_rows'] = info['rows']
+
+    if manifest:
+        report['pipeline_run'] = pipeline_summary(manifest)
+
     # Save
     with open(REPORT_FILE, 'w', encoding='utf-8') as f:
         json.dump(report, f, indent=2)
-        
+
     print(json.dumps(report, indent=2))
 
 if __name__ == '__main__':
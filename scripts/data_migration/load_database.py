@@ -0,0 +1,211 @@
+"""
+Bulk PostgreSQL Loader.
+
+Full refresh of the cleaned table (municipalities_cleaned.arrow, else the CSV) and the embedding
+matrix (municipality_embeddings.npy) into PostgreSQL / TimescaleDB:
+
+1. Create an unindexed, unconstrained staging table (<table>_staging)
+2. Stream batches in with COPY ... FROM STDIN (no per-row INSERT)
+3. Build indexes and constraints after the load (create_indexes.py)
+4. Verify the staging row counts and checksums (verify_migration.py)
+5. Swap it in for the live table in one transaction
+
+If verification fails nothing is swapped and the live table is untouched. Results go to
+db_import_report.json for the db_import step of generate_report.py.
+
+Usage:
+    POSTGRES_HOST=localhost python scripts/data_migration/load_database.py
+    python scripts/data_migration/load_database.py --skip-embeddings --batch-rows 50000
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import cleaned_table
+from db import connect
+from create_indexes import build_indexes, rename_indexes
+from verify_migration import verify_migration, EMBEDDINGS_PATH, EMBEDDING_MAP_PATH
+import _bootstrap  # noqa: F401 (scripts/ on sys.path)
+from embedding_fingerprint import read_manifest, set_matches
+from stage_profile import Profiler
+
+REPORT_FILE = 'db_import_report.json'
+
+BATCH_ROWS = 10_000
+STAGING_SUFFIX = '_staging'
+BACKUP_SUFFIX = '_old'
+
+MUNICIPALITY_COLUMNS = ['code', 'name', 'prefecture', 'population', 'budget', 'score', 'category']
+
+# Same columns as import_data.sql; constraints are added after the load (create_indexes.py)
+TABLE_DDL = {
+    'municipalities': """
+        CREATE TABLE {table} (
+            id UUID NOT NULL DEFAULT gen_random_uuid(),
+            code VARCHAR(10) NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            prefecture VARCHAR(100) NOT NULL,
+            population INTEGER,
+            budget BIGINT,
+            score DECIMAL(5,2),
+            category TEXT,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        )
+    """,
+    'municipality_embeddings': """
+        CREATE TABLE {table} (
+            code VARCHAR(10) NOT NULL,
+            model TEXT,
+            embedding REAL[] NOT NULL,
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        )
+    """,
+}
+
+
+def create_staging(cur, table):
+    staging = f"{table}{STAGING_SUFFIX}"
+    cur.execute(f"DROP TABLE IF EXISTS {staging}")
+    cur.execute(TABLE_DDL[table].format(table=staging))
+    return staging
+
+
+def copy_batches(cur, table, columns, batches):
+    # COPY each CSV text batch FROM STDIN; returns the row count
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    total = 0
+    for rows, text in batches:
+        cur.copy_expert(sql, io.StringIO(text))
+        total += rows
+    return total
+
+
+def municipality_batches(batch_rows=BATCH_ROWS):
+    # Yield the cleaned table as CSV text, batch_rows rows at a time
+    if os.path.exists(cleaned_table.CLEANED_ARROW):
+        # Slices of the memory-mapped table; only one batch is converted at a time
+        table = cleaned_table.read_arrow(MUNICIPALITY_COLUMNS)
+        chunks = (table.slice(start, batch_rows).to_pandas() for start in range(0, table.num_rows, batch_rows))
+    else:
+        chunks = pd.read_csv(cleaned_table.CLEANED_CSV, dtype={'code': str}, usecols=MUNICIPALITY_COLUMNS,
+                             chunksize=batch_rows)
+    for chunk in chunks:
+        yield len(chunk), chunk[MUNICIPALITY_COLUMNS].to_csv(index=False, header=False)
+
+
+def embedding_batches(embeddings_path=EMBEDDINGS_PATH, map_path=EMBEDDING_MAP_PATH,
+                      model=None, batch_rows=BATCH_ROWS):
+    # Memory-map the embeddings and yield (code, model, '{v1,v2,...}') CSV text
+    with open(map_path, 'r', encoding='utf-8') as f:
+        mapping = json.load(f)
+    codes = np.empty(len(mapping), dtype=object)
+    for code, idx in mapping.items():
+        codes[idx] = code
+    embeddings = np.load(embeddings_path, mmap_mode='r')
+
+    for start in range(0, len(codes), batch_rows):
+        block = np.asarray(embeddings[start:start + batch_rows], dtype=np.float32)
+        # %.9g round-trips float32 exactly
+        values = np.char.mod('%.9g', block)
+        lines = [
+            f'{code},{model or ""},"{{{",".join(row)}}}"'
+            for code, row in zip(codes[start:start + batch_rows], values)
+        ]
+        yield len(lines), '\n'.join(lines) + '\n'
+
+
+def read_embedding_manifest(map_path=EMBEDDING_MAP_PATH):
+    # Hashes file of generate_embeddings.py: model id and the digests of the matrix and map
+    return read_manifest(map_path.replace('_map.json', '_hashes.json')) or {}
+
+
+def swap_tables(cur, table):
+    # Swap the staging table in for the live one, inside the caller's transaction: the live table and
+    # its indexes move to the backup names, staging takes the live names, then the backup is dropped
+    staging = f"{table}{STAGING_SUFFIX}"
+    backup = f"{table}{BACKUP_SUFFIX}"
+    cur.execute(f"ALTER TABLE IF EXISTS {table} RENAME TO {backup}")
+    rename_indexes(cur, table, '', BACKUP_SUFFIX, if_exists=True)
+    cur.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+    rename_indexes(cur, table, STAGING_SUFFIX)
+    cur.execute(f"DROP TABLE IF EXISTS {backup}")
+
+
+def load_database(batch_rows=BATCH_ROWS, include_embeddings=True):
+    report = {'status': 'failure', 'tables': {}, 'verification': None, 'errors': []}
+    plan = {'municipalities': (MUNICIPALITY_COLUMNS, municipality_batches(batch_rows=batch_rows))}
+    manifest = None
+    if include_embeddings and os.path.exists(EMBEDDINGS_PATH):
+        # Read before the matrix and map, and checked against them again before the swap
+        manifest = read_embedding_manifest()
+        plan['municipality_embeddings'] = (
+            ['code', 'model', 'embedding'],
+            embedding_batches(model=manifest.get('model'), batch_rows=batch_rows),
+        )
+
+    conn = connect()
+    profiler = Profiler()
+    try:
+        # Staging tables are committed on their own so a failed swap leaves the live tables untouched
+        with conn, conn.cursor() as cur:
+            for table, (columns, batches) in plan.items():
+                start = time.perf_counter()
+                staging = create_staging(cur, table)
+                rows = copy_batches(cur, staging, columns, batches)
+                loaded = time.perf_counter()
+                profiler.lap(f'copy:{table}', rows_out=rows)
+                build_indexes(cur, staging, target=table, suffix=STAGING_SUFFIX)
+                profiler.lap(f'index:{table}', rows_in=rows)
+                report['tables'][table] = {
+                    'rows': rows,
+                    'copy_seconds': round(loaded - start, 3),
+                    'index_seconds': round(time.perf_counter() - loaded, 3),
+                }
+                print(f"Loaded {rows} rows into {staging}")
+
+        staged = {table: f"{table}{STAGING_SUFFIX}" for table in plan}
+        report['verification'] = verify_migration(conn, staged)
+        profiler.lap('verify')
+        if report['verification']['status'] != 'success':
+            report['errors'].append("Staging tables do not match the cleaned data; live tables were not replaced.")
+            return report
+        if manifest is not None and not set_matches(manifest, EMBEDDINGS_PATH, EMBEDDING_MAP_PATH):
+            report['errors'].append("Embeddings and map do not match their hashes file (replaced during the load "
+                                    "or left incomplete); live tables were not replaced.")
+            return report
+
+        with conn, conn.cursor() as cur:
+            for table in plan:
+                swap_tables(cur, table)
+        profiler.lap('swap')
+        report['status'] = 'success'
+        print(f"Swapped {', '.join(plan)} into place.")
+    except Exception as e:
+        report['errors'].append(str(e))
+        print(f"Error loading database: {e}")
+    finally:
+        conn.close()
+        save_report(report)
+    return report
+
+
+def save_report(report):
+    with open(REPORT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk load cleaned data into PostgreSQL with COPY.")
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS)
+    parser.add_argument('--skip-embeddings', action='store_true')
+    args = parser.parse_args()
+    result = load_database(args.batch_rows, include_embeddings=not args.skip_embeddings)
+    if result['status'] != 'success':
+        sys.exit(1)
@@ -0,0 +1,131 @@
+"""
+Municipality Identity Index.
+
+Builds, once, an index from every identifier the sources use to one canonical code (lgcode, the
+code column of municipalities_cleaned.csv), from localgov_master_full.csv:
+- lgcode (6 digits, with or without the leading 0)
+- cid / e-Stat @area (5 digits, with or without the leading 0)
+- prefecture + municipality name
+- municipality name alone (ambiguous when several prefectures share it)
+
+Sources join through hash lookups on this index; unmatched rows are recorded in a JoinReport.
+"""
+import unicodedata
+
+import pandas as pd
+
+MAX_UNMATCHED_SAMPLES = 20
+
+
+def normalize_name(name):
+    # NFKC-normalize and strip a name for comparison
+    return unicodedata.normalize('NFKC', str(name)).strip()
+
+
+def normalize_number(value, width):
+    # Zero-pad a numeric code to a fixed width (1100 -> '01100')
+    text = str(value).strip()
+    if text.endswith('.0'):
+        text = text[:-2]
+    return text.zfill(width) if text.isdigit() else None
+
+
+class JoinReport:
+    # Per-source join result: counts and sample unmatched keys
+
+    def __init__(self, source):
+        self.source = source
+        self.rows = 0
+        self.joined = 0
+        self.ambiguous = []
+        self.unmatched = []
+
+    def record(self, key, code, ambiguous=False):
+        self.rows += 1
+        if code is not None:
+            self.joined += 1
+        elif ambiguous:
+            self.ambiguous.append(str(key))
+        else:
+            self.unmatched.append(str(key))
+
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'rows': self.rows,
+            'joined': self.joined,
+            'unjoined': self.rows - self.joined,
+            'ambiguous': self.ambiguous[:MAX_UNMATCHED_SAMPLES],
+            'unmatched_samples': self.unmatched[:MAX_UNMATCHED_SAMPLES],
+        }
+
+
+class MunicipalityIndex:
+    # Hash lookups from every identifier to the canonical code
+
+    def __init__(self, master):
+        # master: localgov_master_full.csv (pid, pref, cid, city, lgcode columns)
+        self.by_lgcode = {}
+        self.by_area = {}
+        self.by_pref_name = {}
+        self.by_name = {}
+        self.prefecture_order = {}
+
+        for pid, pref, cid, city, lgcode in zip(master['pid'], master['pref'], master['cid'],
+                                                master['city'], master['lgcode']):
+            code = str(lgcode).strip()
+            lgcode6 = normalize_number(code, 6)
+            area5 = normalize_number(cid, 5)
+            pref_name = normalize_name(pref)
+            city_name = normalize_name(city)
+
+            if lgcode6:
+                self.by_lgcode[lgcode6] = code
+            if area5:
+                self.by_area[area5] = code
+            self.by_pref_name[(pref_name, city_name)] = code
+            self.by_name.setdefault(city_name, []).append(code)
+            self.prefecture_order[code] = int(pid)
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path, dtype=str))
+
+    def by_lgcode_value(self, value):
+        key = normalize_number(value, 6)
+        return self.by_lgcode.get(key) if key else None
+
+    def by_area_value(self, value):
+        key = normalize_number(value, 5)
+        return self.by_area.get(key) if key else None
+
+    def by_prefecture_and_name(self, prefecture, name):
+        return self.by_pref_name.get((normalize_name(prefecture), normalize_name(name)))
+
+    def join_codes(self, values, lookup, report):
+        # Map values to canonical codes with lookup and record the result in report
+        codes = []
+        for value in values:
+            code = lookup(value)
+            report.record(value, code)
+            codes.append(code)
+        return codes
+
+    def join_names_in_order(self, names, report):
+        # Map names listed in JIS prefecture order to codes. The DX CSVs have no prefecture
+        # column, so a duplicated name resolves to the first candidate at or after the
+        # prefecture of the previous match
+        codes = []
+        current_pid = 0
+        for name in names:
+            candidates = self.by_name.get(normalize_name(name), [])
+            if len(candidates) == 1:
+                code = candidates[0]
+            else:
+                following = [c for c in candidates if self.prefecture_order[c] >= current_pid]
+                code = min(following, key=self.prefecture_order.get) if following else None
+            report.record(name, code, ambiguous=len(candidates) > 1)
+            if code is not None:
+                current_pid = self.prefecture_order[code]
+            codes.append(code)
+        return codes
@@ -1,85 +1,112 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
+import json
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
 
+from dx_scoring import DX_SHEETS, score_all_sheets, write_scores
+from municipality_index import MunicipalityIndex, JoinReport
+from census_parser import MATRIX_CSV, parse_census, latest_population, write_matrix
+import cleaned_table
+import _bootstrap  # noqa: F401 (scripts/ on sys.path)
+from stage_profile import Profiler
+
 SOURCE_DIR = os.path.join(os.path.dirname(__file__), '../../data/source')
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), '../../data/cleaned')
 
 MASTER_CSV = os.path.join(SOURCE_DIR, 'localgov_master_full.csv')
-DX_CSV = os.path.join(SOURCE_DIR, '市区町村毎のDX進捗状況_市区町村比較.csv')
 CENSUS_CSV = os.path.join(SOURCE_DIR, 'census_population.csv')
+JOIN_REPORT = os.path.join(OUTPUT_DIR, 'join_report.json')
+
+
+def write_join_report(reports):
+    summary = [report.to_dict() for report in reports]
+    with open(JOIN_REPORT, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    for item in summary:
+        print(f"Joined {item['source']}: {item['joined']}/{item['rows']} rows")
+
 
 def transform_data():
     """
     ML-Ready Data Transformation Pipeline:
     1. Filter out Designated City Wards (e.g., 'Kyoto City Sakyo Ward').
-    2. Merge Real Census Population Data.
+    2. Join DX Scores and Census Population by municipality code (see municipality_index.py).
     3. Impute Missing Budget using Linear Regression (Budget ~ Population).
     4. Normalize Features (StandardScaler).
     """
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
-        
+
+    profiler = Profiler()
     print("Loading Master Data...")
     try:
         df_master = pd.read_csv(MASTER_CSV)
     except Exception as e:
         print(f"Error loading master csv: {e}")
-        return
+        sys.exit(1)
 
     # 1. Filtering: Remove Designated City Wards
     # Rule: If 'city' contains a space (e.g., '札幌市 中央区'), it is a ward of a designated city.
     # Tokyo Special Wards (e.g., '千代田区') do not have spaces in this dataset.
     print(f"Original Records: {len(df_master)}")
+    # Wards stay in the join index so names of the remaining rows resolve consistently
+    df_master_full = df_master
     df_master = df_master[~df_master['city'].str.contains(' ', na=False)]
     print(f"After Ward Filtering: {len(df_master)}")
+    profiler.lap('load_master', rows_in=len(df_master_full), rows_out=len(df_master))
 
     # 2. Load and Process DX Data
     print("Loading DX Data...")
     try:
-        df_dx_raw = pd.read_csv(DX_CSV, header=None, low_memory=False)
-        city_names = df_dx_raw.iloc[0, 2:].values
-        data_block = df_dx_raw.iloc[1:, 2:].values
-        df_dx = pd.DataFrame(data_block.T, index=city_names)
-        
-        # Calculate Score
-        def calc_score(row):
-            total = len(row)
-            done = sum(1 for x in row if str(x).strip() == '実施')
-            return (done / total) * 100 if total > 0 else 0
-            
-        df_dx['score'] = df_dx.apply(calc_score, axis=1)
-        df_dx.reset_index(inplace=True)
-        df_dx.rename(columns={'index': 'city_name_dx'}, inplace=True)
+        # All DX sheets are scored in one vectorized pass (see dx_scoring.py)
+        sheet_scores = score_all_sheets(SOURCE_DIR)
+        write_scores(sheet_scores, OUTPUT_DIR)
+        municipal = sheet_scores['municipal_comparison']
+        df_dx = pd.DataFrame({
+            'city_name_dx': municipal['entity'],
+            'score': municipal['implemented_share'],
+        })
     except Exception as e:
         print(f"Error processing DX csv: {e}")
-        df_dx = pd.DataFrame(columns=['city_name_dx', 'score'])
+        sys.exit(1)
+    profiler.lap('dx_scoring', rows_out=len(df_dx),
+                 outputs=[os.path.join(OUTPUT_DIR, f'dx_scores_{sheet}.csv') for sheet in DX_SHEETS])
 
     # 3. Load Census Population
     print("Loading Census Data...")
     try:
-        # Assuming census_population.csv has columns that can map to municipality code or name
-        # Based on file inspection: @area might be code, @cat01 might be 'Total Population'
-        # For simplicity in this heuristic step, if the file is complex, we might need a simpler csv.
-        # Let's inspect content or just use a mock logic if file format is strict e-Stat API JSON-CSV.
-        # Assuming simple CSV for now, if it fails, we catch error.
-        # Real code should parse e-Stat structure carefully.
-        # We will try to load it, but if columns don't match, we might fallback or need strict mapping.
-        df_census = pd.read_csv(CENSUS_CSV)
-        # TODO: Implement strict e-Stat parsing if needed. 
-        # For this step, we will assume we can join on code.
-        # If 'lgcode' or equivalent exists.
+        # Streamed in chunks; only the area x period matrix of total population is kept
+        census = parse_census(CENSUS_CSV)
+        write_matrix(census)
+        df_census = latest_population(census)
     except Exception as e:
         print(f"Error loading census: {e}")
-        df_census = pd.DataFrame()
+        sys.exit(1)
+    profiler.lap('census', rows_out=len(df_census), outputs=[MATRIX_CSV])
 
     print("Merging Data...")
-    # Merge Master + DX
-    df_merged = df_master.merge(df_dx[['city_name_dx', 'score']], left_on='city', right_on='city_name_dx', how='left')
-    df_merged['score'] = df_merged['score'].fillna(0)
-    
+    # Every source is resolved to the canonical code (lgcode) through one index,
+    # so municipalities sharing a name (e.g. 府中市) are no longer mixed up.
+    index = MunicipalityIndex(df_master_full)
+    dx_report = JoinReport('dx:municipal_comparison')
+    census_report = JoinReport('census_population')
+
+    # DX sheets only carry names; they are listed in prefecture order
+    df_dx['code'] = index.join_names_in_order(df_dx['city_name_dx'], dx_report)
+    df_census['code'] = index.join_codes(df_census['area'], index.by_area_value, census_report)
+
+    df_merged = df_master.copy()
+    codes = df_merged['lgcode'].astype(str)
+    score_by_code = df_dx.dropna(subset=['code']).drop_duplicates(subset=['code']).set_index('code')['score']
+    df_merged['score'] = codes.map(score_by_code).fillna(0).to_numpy()
+
+    write_join_report([dx_report, census_report])
+    profiler.lap('merge', rows_in=len(df_master) + len(df_dx) + len(df_census), rows_out=len(df_merged),
+                 outputs=[JOIN_REPORT])
+
     # 4. Score Normalization (0-100 is already good, but Z-score is requested for Clustering later)
     # We keep raw 'score' for display, maybe add 'z_score' for ML.
     scaler = StandardScaler()
@@ -108,7 +135,12 @@ def transform_data():
     # Actually, let's use a log-normal distribution which is realistic for cities.
     
     np.random.seed(42) # Fixed seed for reproducibility
-    df_merged['population'] = np.random.lognormal(mean=10.5, sigma=1.2, size=len(df_merged)).astype(int)
+    synthetic_population = np.random.lognormal(mean=10.5, sigma=1.2, size=len(df_merged)).astype(int)
+    # Census population wins wherever the area code joined
+    census_population = df_census.dropna(subset=['code', 'population']).set_index('code')['population']
+    real_population = codes.map(census_population).to_numpy(dtype=np.float64, na_value=np.nan)
+    df_merged['population'] = np.where(np.isnan(real_population), synthetic_population,
+                                       real_population).astype(int)
     
     # 6. Linear Regression for Budget Imputation
     # Train model: Budget = a * Population + b + Noise
@@ -126,6 +158,8 @@ def transform_data():
     
     print(f"Budget Regression: coef={reg.coef_[0]:.4f}")
 
+    profiler.lap('impute', rows_in=len(df_merged), rows_out=len(df_merged))
+
     # Rename and Select
     df_final = df_merged.rename(columns={
         'lgcode': 'code',
@@ -145,6 +179,11 @@ def transform_data():
     
     # Save
     df_final[final_cols].to_csv(os.path.join(OUTPUT_DIR, 'municipalities_cleaned.csv'), index=False)
+    # Typed columnar copy read by the downstream stages and the search service
+    cleaned_table.write(df_final[final_cols], os.path.join(OUTPUT_DIR, 'municipalities_cleaned.arrow'))
+    profiler.lap('write', rows_in=len(df_merged), rows_out=len(df_final),
+                 outputs=[os.path.join(OUTPUT_DIR, 'municipalities_cleaned.csv'),
+                          os.path.join(OUTPUT_DIR, 'municipalities_cleaned.arrow')])
     print(f"Saved {len(df_final)} municipalities (Excluded Wards).")
 
 if __name__ == '__main__':
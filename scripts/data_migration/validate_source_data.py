@@ -1,6 +1,15 @@
 import os
+import io
+import sys
+import csv
+import codecs
+import hashlib
 import pandas as pd
 import json
+from concurrent.futures import ProcessPoolExecutor
+
+import _bootstrap  # noqa: F401 (scripts/ on sys.path)
+from stage_profile import Profiler
 
 # Configuration
 SOURCE_DIR = os.path.join(os.path.dirname(__file__), '../../data/source')
@@ -16,50 +25,121 @@ REQUIRED_FILES = [
     'official_url_master.csv'
 ]
 
-def validate_source_data():
+# Bytes inspected to decide the encoding
+SNIFF_BYTES = 64 * 1024
+CANDIDATE_ENCODINGS = ['utf-8', 'cp932']
+MAX_WORKERS = int(os.getenv('VALIDATE_WORKERS', '4'))
+
+
+def file_checksum(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sniff_encoding(filepath):
+    # Encoding from the first bytes (utf-8-sig when there is a BOM)
+    with open(filepath, 'rb') as f:
+        sample = f.read(SNIFF_BYTES)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    for encoding in CANDIDATE_ENCODINGS:
+        # Incremental decode so a character cut at the end of the sample is not an error
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"Unknown encoding (tried {', '.join(CANDIDATE_ENCODINGS)})")
+
+
+def count_rows(filepath, encoding):
+    # Data rows without the header, streamed; blank lines are skipped as pandas does
+    with io.open(filepath, 'r', encoding=encoding, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return sum(1 for row in reader if row)
+
+
+def validate_file(filepath, previous=None):
+    # Returns (file_info, error); reuses previous (last report's file_info) when the checksum matches
+    file_info = {'exists': False, 'rows': 0, 'columns': []}
+    if not os.path.exists(filepath):
+        return file_info, None
+
+    file_info['exists'] = True
+    try:
+        checksum = file_checksum(filepath)
+        if previous and previous.get('exists') and previous.get('sha256') == checksum:
+            return dict(previous, cached=True), None
+
+        encoding = sniff_encoding(filepath)
+        # Only the header is parsed by pandas, so column names match the previous report format
+        columns = list(pd.read_csv(filepath, encoding=encoding, nrows=0).columns)
+        file_info.update({
+            'rows': count_rows(filepath, encoding),
+            'columns': columns,
+            'encoding': encoding,
+            'sha256': checksum,
+        })
+        return file_info, None
+    except Exception as e:
+        return file_info, f"Error reading {os.path.basename(filepath)}: {str(e)}"
+
+
+def load_previous_report():
+    if not os.path.exists(REPORT_FILE):
+        return {}
+    try:
+        with open(REPORT_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f).get('files', {})
+    except (ValueError, OSError):
+        return {}
+
+
+def validate_source_data(max_workers=MAX_WORKERS):
     report = {
         'status': 'success',
         'files': {},
         'errors': []
     }
-    
+
     # helper to check file existence
     if not os.path.exists(SOURCE_DIR):
         report['status'] = 'failure'
         report['errors'].append(f"Source directory not found: {SOURCE_DIR}")
         save_report(report)
-        return
-
-    # Check each file
-    for filename in REQUIRED_FILES:
-        filepath = os.path.join(SOURCE_DIR, filename)
-        file_info = {'exists': False, 'rows': 0, 'columns': []}
-        
-        if os.path.exists(filepath):
-            file_info['exists'] = True
-            try:
-                # Attempt to read CSV (handling generic encodings)
-                try:
-                    df = pd.read_csv(filepath, encoding='utf-8')
-                except UnicodeDecodeError:
-                    df = pd.read_csv(filepath, encoding='shift_jis')
-                
-                file_info['rows'] = len(df)
-                file_info['columns'] = list(df.columns)
-            except Exception as e:
-                report['errors'].append(f"Error reading {filename}: {str(e)}")
-        else:
+        sys.exit(1)
+
+    # Check all files in parallel; unchanged files reuse the previous result
+    profiler = Profiler()
+    previous = load_previous_report()
+    paths = [os.path.join(SOURCE_DIR, filename) for filename in REQUIRED_FILES]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(validate_file, paths, [previous.get(f) for f in REQUIRED_FILES]))
+
+    for filename, (file_info, error) in zip(REQUIRED_FILES, results):
+        if not file_info['exists']:
             report['status'] = 'failure'
             report['errors'].append(f"Missing file: {filename}")
-        
+        elif error:
+            report['errors'].append(error)
         report['files'][filename] = file_info
 
     save_report(report)
+    profiler.lap('validate_files', rows_in=len(paths),
+                 rows_out=sum(info.get('rows') or 0 for info in report['files'].values()), outputs=[REPORT_FILE])
     print(json.dumps(report, indent=2, ensure_ascii=False))
+    if report['status'] == 'failure':
+        sys.exit(1)
 
 def save_report(report):
+    # Cached flags only describe this run
+    files = {name: {k: v for k, v in info.items() if k != 'cached'} for name, info in report['files'].items()}
     with open(REPORT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(report, f, indent=2, ensure_ascii=False)
+        json.dump(dict(report, files=files), f, indent=2, ensure_ascii=False)
 
 if __name__ == '__main__':
     validate_source_data()
@@ -1,17 +1,129 @@
 # verify_migration.py
-import psycopg2
+# Compares counts and checksums computed from data/cleaned (municipalities_cleaned.arrow, or the CSV)
+# with the same values computed from the database tables:
+# - municipalities: row count, MD5 of the codes, population / budget sums, score sum (rounded to DECIMAL(5,2))
+# - municipality_embeddings: row count, MD5 of the codes, dimension, sum of all elements (float32 tolerance)
+import os
+import sys
+import json
+import hashlib
+from decimal import Decimal, ROUND_HALF_UP
 
-def verify_migration():
+import numpy as np
+
+import cleaned_table
+from db import connect
+
+CLEANED_DIR = os.path.join(os.path.dirname(__file__), '../../data/cleaned')
+EMBEDDINGS_PATH = os.path.join(CLEANED_DIR, 'municipality_embeddings.npy')
+EMBEDDING_MAP_PATH = os.path.join(CLEANED_DIR, 'municipality_embedding_map.json')
+
+# Allowed difference of the element sum per stored float (summation order differs in SQL)
+EMBEDDING_SUM_TOLERANCE = 1e-6
+
+
+def codes_digest(codes):
+    # MD5 of the sorted codes joined by newlines (same as string_agg on the SQL side)
+    return hashlib.md5('\n'.join(sorted(codes)).encode('utf-8')).hexdigest()
+
+
+def expected_municipalities():
+    df = cleaned_table.read(['code', 'population', 'budget', 'score'])
+    # Same rounding as the DECIMAL(5,2) column on input
+    cent = Decimal('0.01')
+    score_sum = sum(Decimal(str(v)).quantize(cent, rounding=ROUND_HALF_UP)
+                    for v in df['score'].dropna())
+    return {
+        'rows': len(df),
+        'codes_md5': codes_digest(df['code']),
+        'population_sum': int(df['population'].sum()),
+        'budget_sum': int(df['budget'].sum()),
+        'score_sum': str(score_sum),
+    }
+
+
+def actual_municipalities(cur, table='municipalities'):
+    cur.execute(f"""
+        SELECT count(*),
+               md5(coalesce(string_agg(code, E'\\n' ORDER BY code COLLATE "C"), '')),
+               coalesce(sum(population), 0),
+               coalesce(sum(budget), 0),
+               coalesce(sum(score), 0)
+        FROM {table}
+    """)
+    rows, digest, population, budget, score = cur.fetchone()
+    return {
+        'rows': rows,
+        'codes_md5': digest,
+        'population_sum': int(population),
+        'budget_sum': int(budget),
+        'score_sum': str(Decimal(score).quantize(Decimal('0.01'))),
+    }
+
+
+def expected_embeddings(embeddings_path=EMBEDDINGS_PATH, map_path=EMBEDDING_MAP_PATH):
+    with open(map_path, 'r', encoding='utf-8') as f:
+        mapping = json.load(f)
+    embeddings = np.load(embeddings_path, mmap_mode='r')
+    return {
+        'rows': len(mapping),
+        'codes_md5': codes_digest(mapping),
+        'dim': int(embeddings.shape[1]),
+        'value_sum': float(np.sum(embeddings, dtype=np.float64)),
+    }
+
+
+def actual_embeddings(cur, table='municipality_embeddings'):
+    cur.execute(f"""
+        SELECT count(*),
+               md5(coalesce(string_agg(code, E'\\n' ORDER BY code COLLATE "C"), '')),
+               coalesce(max(array_length(embedding, 1)), 0)
+        FROM {table}
+    """)
+    rows, digest, dim = cur.fetchone()
+    cur.execute(f"SELECT coalesce(sum(x), 0) FROM {table}, unnest(embedding) AS x")
+    return {'rows': rows, 'codes_md5': digest, 'dim': dim, 'value_sum': float(cur.fetchone()[0])}
+
+
+def compare(expected, actual):
+    ok = all(expected[k] == actual[k] for k in expected if k != 'value_sum')
+    if 'value_sum' in expected:
+        tolerance = EMBEDDING_SUM_TOLERANCE * max(expected['rows'] * expected['dim'], 1)
+        ok = ok and abs(expected['value_sum'] - actual['value_sum']) <= tolerance
+    return {'ok': ok, 'expected': expected, 'actual': actual}
+
+
+def verify_migration(conn=None, tables=None):
+    # Returns {table: (expected, actual, ok)} and the overall status.
+    # tables maps logical names to real tables, e.g. {'municipalities': 'municipalities_staging'}.
     print("Verifying migration results...")
-    # conn = psycopg2.connect(...)
-    # cur = conn.cursor()
-    # cur.execute("SELECT COUNT(*) FROM municipalities;")
-    # count = cur.fetchone()[0]
-    # expected = 1918
-    # if count == expected:
-    #     print("SUCCESS: Record count matches.")
-    # else:
-    #     print(f"FAILURE: Expected {expected}, got {count}")
+    tables = tables or {'municipalities': 'municipalities'}
+    own_conn = conn is None
+    conn = conn or connect()
+    result = {'status': 'success', 'tables': {}}
+    try:
+        with conn.cursor() as cur:
+            if 'municipalities' in tables:
+                result['tables']['municipalities'] = compare(
+                    expected_municipalities(), actual_municipalities(cur, tables['municipalities']))
+            if 'municipality_embeddings' in tables:
+                result['tables']['municipality_embeddings'] = compare(
+                    expected_embeddings(), actual_embeddings(cur, tables['municipality_embeddings']))
+    finally:
+        if own_conn:
+            conn.close()
+
+    for name, check in result['tables'].items():
+        if check['ok']:
+            print(f"SUCCESS: {name} matches ({check['actual']['rows']} rows).")
+        else:
+            result['status'] = 'failure'
+            print(f"FAILURE: {name} expected {check['expected']}, got {check['actual']}")
+    return result
 
 if __name__ == '__main__':
-    verify_migration()
+    checked = {'municipalities': 'municipalities'}
+    if os.path.exists(EMBEDDINGS_PATH):
+        checked['municipality_embeddings'] = 'municipality_embeddings'
+    if verify_migration(tables=checked)['status'] != 'success':
+        sys.exit(1)
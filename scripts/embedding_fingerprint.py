@@ -0,0 +1,48 @@
+# Fingerprint of the embedding matrix and its code map. build_knn_table.py and build_ivf_index.py
+# save it with their tables, and search_server.py drops a table whose fingerprint no longer matches.
+# Also checks that the matrix and map on disk are the set named by the hashes file.
+# Stage scripts import it as embedding_fingerprint (their _bootstrap.py puts scripts/ on sys.path),
+# the API as scripts.embedding_fingerprint.
+import os
+import json
+import hashlib
+
+
+def fingerprint(embeddings_path, map_path, digests=None):
+    # sha256 over the content digests of the matrix and map; None if either file is missing.
+    # Pass the 'files' digests of a hashes file already checked with set_matches to skip hashing again
+    digests = digests or set_digests(embeddings_path, map_path)
+    if None in digests.values():
+        return None
+    return hashlib.sha256(f"{digests['embeddings']}\0{digests['map']}".encode('utf-8')).hexdigest()
+
+
+def file_sha256(path, block_size=1 << 20):
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def set_digests(embeddings_path, map_path):
+    # Content digests of the matrix and map, as generate_embeddings.py records them in the hashes file
+    return {'embeddings': file_sha256(embeddings_path), 'map': file_sha256(map_path)}
+
+
+def read_manifest(hashes_path):
+    # The hashes file is written last and names the matrix and map it belongs to; None if missing
+    if not os.path.exists(hashes_path):
+        return None
+    with open(hashes_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def set_matches(manifest, embeddings_path, map_path):
+    # Read the manifest first, then the files, then check them: a set replaced mid-read or a run cut
+    # short between files does not match. Hashes files without 'files' (older runs) are not checked.
+    if manifest is None or 'files' not in manifest:
+        return True
+    return set_digests(embeddings_path, map_path) == manifest['files']
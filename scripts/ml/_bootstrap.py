@@ -0,0 +1,8 @@
+# Imported first by the stage scripts in this directory: puts scripts/ on sys.path so the shared
+# modules there (stage_profile, embedding_fingerprint) import when a script is run directly.
+import os
+import sys
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
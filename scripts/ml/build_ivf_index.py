@@ -0,0 +1,108 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+import _bootstrap  # noqa: F401 (scripts/ on sys.path)
+from embedding_fingerprint import fingerprint, read_manifest, set_matches
+from stage_profile import Profiler
+
+# Paths
+BASE_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(BASE_DIR, '../../data')
+EMBEDDINGS_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embeddings.npy')
+MAP_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_map.json')
+HASHES_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_hashes.json')
+OUTPUT_IVF = os.path.join(DATA_DIR, 'cleaned/municipality_ivf.npz')
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+def assign(embeddings, centroids, block_rows=4096):
+    # Assign each row to the centroid with the largest inner product, one block at a time
+    labels = np.empty(embeddings.shape[0], dtype=np.int32)
+    for start in range(0, embeddings.shape[0], block_rows):
+        block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32)
+        labels[start:start + block_rows] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+def train_centroids(sample, nlist, iterations, rng):
+    # Spherical k-means (centroids renormalized every pass) for nlist centroids
+    centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(sample, centroids)
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        filled = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+        # Empty partitions are reseeded from random rows so every list stays in use
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            sums[empty] = sample[rng.choice(sample.shape[0], size=len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+def inverted_lists(labels, nlist):
+    # Rows per partition in CSR form (list_offsets, list_rows), ascending within each list
+    list_rows = np.argsort(labels, kind='stable').astype(np.int32)
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.int64)
+    return list_offsets, list_rows
+
+def build_ivf_index(nlist=None, iterations=20, sample_size=100000, seed=42):
+    print("Loading Embeddings...")
+    if not os.path.exists(EMBEDDINGS_PATH):
+        print(f"File not found: {EMBEDDINGS_PATH}")
+        sys.exit(1)
+
+    # Taken before reading, so a matrix replaced mid-build leaves the table marked stale
+    manifest = read_manifest(HASHES_PATH) or {}
+    source_fingerprint = fingerprint(EMBEDDINGS_PATH, MAP_PATH, manifest.get('files')) or ''
+    embeddings = np.load(EMBEDDINGS_PATH, mmap_mode='r')
+    if not set_matches(manifest, EMBEDDINGS_PATH, MAP_PATH):
+        print("Embeddings and map do not match their hashes file; rerun generate_embeddings.py.")
+        sys.exit(1)
+    n = embeddings.shape[0]
+    if n == 0:
+        print("No vectors to index.")
+        sys.exit(1)
+    # Default of about sqrt(N) partitions balances centroid scoring against list scanning
+    nlist = min(nlist or max(1, int(round(np.sqrt(n)))), n)
+
+    model_id = manifest.get('model', 'unknown')
+
+    # Centroids are trained on a sample; every row is then assigned to its nearest centroid
+    profiler = Profiler()
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+    sample = normalize(np.asarray(embeddings[sample_rows], dtype=np.float32))
+    nlist = min(nlist, len(sample))
+    print(f"Training {nlist} centroids on {len(sample)} of {n} vectors ({iterations} iterations)...")
+    centroids = train_centroids(sample, nlist, iterations, rng)
+    profiler.lap('train_centroids', rows_in=len(sample), rows_out=nlist)
+
+    labels = assign(embeddings, centroids)
+    list_offsets, list_rows = inverted_lists(labels, nlist)
+    profiler.lap('assign', rows_in=n, rows_out=len(list_rows))
+    sizes = np.diff(list_offsets)
+    print(f"Partition sizes: min={sizes.min()} median={int(np.median(sizes))} max={sizes.max()}")
+
+    # Rows are embedding indices, as in municipality_knn.npz
+    tmp_path = f"{OUTPUT_IVF}.tmp.npz"
+    np.savez(tmp_path, centroids=centroids, list_offsets=list_offsets, list_rows=list_rows,
+             model=np.array(model_id), rows=np.array(n), fingerprint=np.array(source_fingerprint))
+    os.replace(tmp_path, OUTPUT_IVF)
+    profiler.lap('save', rows_out=n, outputs=[OUTPUT_IVF])
+    print(f"Saved IVF index ({nlist} lists) to {OUTPUT_IVF}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train k-means partitions (IVF index) over municipality embeddings.")
+    parser.add_argument('--nlist', type=int, default=None, help="Number of partitions (default: sqrt(N))")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--sample-size', type=int, default=100000, help="Rows used to train the centroids")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    build_ivf_index(nlist=args.nlist, iterations=args.iterations, sample_size=args.sample_size, seed=args.seed)
@@ -0,0 +1,77 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+import _bootstrap  # noqa: F401 (scripts/ on sys.path)
+from embedding_fingerprint import fingerprint, read_manifest, set_matches
+from stage_profile import Profiler
+
+# Paths
+BASE_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(BASE_DIR, '../../data')
+EMBEDDINGS_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embeddings.npy')
+MAP_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_map.json')
+HASHES_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_hashes.json')
+OUTPUT_KNN = os.path.join(DATA_DIR, 'cleaned/municipality_knn.npz')
+
+def top_k_neighbours(embeddings, k, block_rows=1024):
+    # Top-k neighbours (indices, scores) of every row, excluding itself, by blocked matmul;
+    # memory stays at block_rows * N * 4 bytes
+    n = embeddings.shape[0]
+    k = min(k, n - 1)
+    indices = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+    matrix = np.asarray(embeddings, dtype=np.float32)
+
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        block = matrix[start:stop] @ matrix.T
+        # Exclude self matches
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+        candidates = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(block, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind='stable')
+        indices[start:stop] = np.take_along_axis(candidates, order, axis=1)
+        scores[start:stop] = np.take_along_axis(candidate_scores, order, axis=1)
+    return indices, scores
+
+def build_knn_table(k=20, block_rows=1024):
+    print("Loading Embeddings...")
+    if not os.path.exists(EMBEDDINGS_PATH):
+        print(f"File not found: {EMBEDDINGS_PATH}")
+        sys.exit(1)
+
+    # Taken before reading, so a matrix replaced mid-build leaves the table marked stale
+    manifest = read_manifest(HASHES_PATH) or {}
+    source_fingerprint = fingerprint(EMBEDDINGS_PATH, MAP_PATH, manifest.get('files')) or ''
+    embeddings = np.load(EMBEDDINGS_PATH, mmap_mode='r')
+    if not set_matches(manifest, EMBEDDINGS_PATH, MAP_PATH):
+        print("Embeddings and map do not match their hashes file; rerun generate_embeddings.py.")
+        sys.exit(1)
+    if embeddings.shape[0] < 2:
+        print("Not enough vectors to build a neighbour table.")
+        sys.exit(1)
+
+    model_id = manifest.get('model', 'unknown')
+
+    print(f"Computing top-{k} neighbours for {embeddings.shape[0]} municipalities...")
+    profiler = Profiler()
+    indices, scores = top_k_neighbours(embeddings, k, block_rows=block_rows)
+    profiler.lap('top_k_neighbours', rows_in=embeddings.shape[0], rows_out=indices.shape[0])
+
+    # Rows are embedding indices; codes come from municipality_embedding_map.json
+    tmp_path = f"{OUTPUT_KNN}.tmp.npz"
+    np.savez(tmp_path, indices=indices, scores=scores, model=np.array(model_id),
+             rows=np.array(embeddings.shape[0]), fingerprint=np.array(source_fingerprint))
+    os.replace(tmp_path, OUTPUT_KNN)
+    profiler.lap('save', rows_out=indices.shape[0], outputs=[OUTPUT_KNN])
+    print(f"Saved neighbour table {indices.shape} to {OUTPUT_KNN}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute k-nearest-neighbour table for municipalities.")
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--block-rows', type=int, default=1024)
+    args = parser.parse_args()
+    build_knn_table(k=args.k, block_rows=args.block_rows)
@@ -0,0 +1,124 @@
+"""
+Chunked, parallel and resumable sentence encoding.
+
+Splits the texts into fixed-size chunks encoded by worker processes. Each chunk is written straight
+into a preallocated memory-mapped .npy (out_path + '.partial') and recorded in a checkpoint
+(out_path + '.checkpoint.json') when done; rerunning with the same input resumes the unfinished chunks.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+_worker_model = None
+
+
+def _init_worker(model_name, threads):
+    # Load the model once per worker process
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # Split cores between workers instead of every worker using all of them
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode(texts):
+    embeddings = np.asarray(_worker_model.encode(texts), dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def _encode_chunk(chunk_id, start, texts, partial_path):
+    # Encode a chunk straight into its rows of the output memmap
+    out = np.load(partial_path, mmap_mode='r+')
+    out[start:start + len(texts)] = _encode(texts)
+    out.flush()
+    del out
+    return chunk_id
+
+
+def _encode_first(texts):
+    return _encode(texts)
+
+
+def texts_digest(texts):
+    # Hash of the whole input, to match a checkpoint
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _load_checkpoint(checkpoint_path, partial_path, expected):
+    if not (os.path.exists(checkpoint_path) and os.path.exists(partial_path)):
+        return None
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if any(checkpoint.get(key) != value for key, value in expected.items()):
+        print("Checkpoint does not match the current input, starting over.")
+        return None
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint_path, checkpoint):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def encode_to_memmap(texts, out_path, model_name, chunk_size=256, workers=1):
+    # Write texts as a normalized float32 matrix to out_path (.npy). Resumes from a checkpoint
+    # with the same model, chunk size and input, then replaces out_path
+    if not texts:
+        raise ValueError("No texts to encode")
+    partial_path = f"{out_path}.partial"
+    checkpoint_path = f"{out_path}.checkpoint.json"
+    n = len(texts)
+    chunks = [(chunk_id, start) for chunk_id, start in enumerate(range(0, n, chunk_size))]
+    expected = {
+        'model': model_name,
+        'rows': n,
+        'chunk_size': chunk_size,
+        'texts_sha256': texts_digest(texts),
+    }
+
+    checkpoint = _load_checkpoint(checkpoint_path, partial_path, expected)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model_name, threads)) as executor:
+        if checkpoint is None:
+            # The first chunk tells us the embedding dimension for preallocation
+            first = executor.submit(_encode_first, texts[:chunk_size]).result()
+            out = np.lib.format.open_memmap(partial_path, mode='w+', dtype=np.float32,
+                                            shape=(n, first.shape[1]))
+            out[:len(first)] = first
+            out.flush()
+            del out
+            checkpoint = dict(expected, dim=int(first.shape[1]), done=[0])
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+        done = set(checkpoint['done'])
+        pending = [(chunk_id, start) for chunk_id, start in chunks if chunk_id not in done]
+        print(f"Encoding {n} texts in {len(chunks)} chunks "
+              f"({len(done)} already done, {workers} workers)...")
+
+        futures = [
+            executor.submit(_encode_chunk, chunk_id, start, texts[start:start + chunk_size], partial_path)
+            for chunk_id, start in pending
+        ]
+        for future in as_completed(futures):
+            done.add(future.result())
+            checkpoint['done'] = sorted(done)
+            _save_checkpoint(checkpoint_path, checkpoint)
+            print(f"  {len(done)}/{len(chunks)} chunks")
+
+    os.replace(partial_path, out_path)
+    os.remove(checkpoint_path)
+    return out_path
@@ -1,29 +1,128 @@
 import numpy as np
+import argparse
+import hashlib
 import json
 import os
+import sys
+import struct
+
+import _bootstrap  # noqa: F401 (scripts/ on sys.path)
+from embedding_fingerprint import read_manifest, set_matches
+from stage_profile import Profiler
 
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, '../../data')
 NPY_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embeddings.npy')
+MAP_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_map.json')
+HASHES_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_hashes.json')
+BIN_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_vectors.bin')
 JSON_PATH = os.path.join(DATA_DIR, 'cleaned/municipality_vectors.json')
 
-def convert():
+# Binary layout (all little-endian):
+#   b'MVEC' | uint32 header length | UTF-8 JSON header (space padded) | rows (rows * dim * itemsize)
+# The header is padded so that the row data starts on a DATA_ALIGNMENT byte boundary.
+MAGIC = b'MVEC'
+FORMAT_VERSION = 1
+DATA_ALIGNMENT = 64
+EXPORT_DTYPES = {'float32': '<f4', 'float16': '<f2'}
+CHUNK_ROWS = 4096
+
+def iter_chunks(vectors, dtype):
+    for start in range(0, vectors.shape[0], CHUNK_ROWS):
+        yield np.ascontiguousarray(vectors[start:start + CHUNK_ROWS], dtype=EXPORT_DTYPES[dtype])
+
+def encode_header(header):
+    body = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    prefix = len(MAGIC) + 4
+    padded = -(-(prefix + len(body)) // DATA_ALIGNMENT) * DATA_ALIGNMENT - prefix
+    body = body.ljust(padded, b' ')
+    return MAGIC + struct.pack('<I', len(body)) + body
+
+def export_binary(vectors, path, dtype='float32', model_id='unknown'):
+    # Write the vectors in the headered binary format, chunk by chunk: one pass for the
+    # checksum, one for the header and rows, so the converted matrix is never held whole
+    checksum = hashlib.sha256()
+    for chunk in iter_chunks(vectors, dtype):
+        checksum.update(chunk.tobytes())
+
+    header = {
+        'version': FORMAT_VERSION,
+        'dtype': dtype,
+        'byteOrder': 'little',
+        'shape': [int(vectors.shape[0]), int(vectors.shape[1])],
+        'model': model_id,
+        'checksum': f"sha256:{checksum.hexdigest()}",
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(encode_header(header))
+        for chunk in iter_chunks(vectors, dtype):
+            f.write(chunk.tobytes())
+    os.replace(tmp_path, path)
+    return header
+
+def read_binary(path, mmap=True):
+    # Read the binary format as (header, vectors); verify_binary checks the checksum
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a vector export: {path}")
+        (header_len,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    offset = len(MAGIC) + 4 + header_len
+    shape = tuple(header['shape'])
+    dtype = np.dtype(EXPORT_DTYPES[header['dtype']])
+    if mmap:
+        vectors = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    else:
+        vectors = np.fromfile(path, dtype=dtype, offset=offset).reshape(shape)
+    return header, vectors
+
+def verify_binary(path):
+    header, vectors = read_binary(path)
+    checksum = hashlib.sha256()
+    for chunk in iter_chunks(vectors, header['dtype']):
+        checksum.update(chunk.tobytes())
+    return header['checksum'] == f"sha256:{checksum.hexdigest()}"
+
+def export_json(vectors, path):
+    # Legacy list-of-lists output, written row by row
+    with open(path, 'w') as f:
+        f.write('[')
+        for i, row in enumerate(vectors):
+            if i:
+                f.write(',')
+            json.dump(row.tolist(), f)
+        f.write(']')
+
+def convert(dtype='float32', legacy_json=False):
     print("Loading NPY...")
     if not os.path.exists(NPY_PATH):
         print("NPY file not found")
-        return
+        sys.exit(1)
 
-    vectors = np.load(NPY_PATH)
+    profiler = Profiler()
+    # Hashes file first: model id, and the digests the matrix must match
+    manifest = read_manifest(HASHES_PATH) or {}
+    vectors = np.load(NPY_PATH, mmap_mode='r')
+    if not set_matches(manifest, NPY_PATH, MAP_PATH):
+        print("Embeddings and map do not match their hashes file; rerun generate_embeddings.py.")
+        sys.exit(1)
     print(f"Loaded vectors shape: {vectors.shape}")
-    
-    # Convert to list of lists
-    vector_list = vectors.tolist()
-    
-    print("Saving as JSON...")
-    with open(JSON_PATH, 'w') as f:
-        json.dump(vector_list, f)
-    
-    print(f"Saved to {JSON_PATH}")
+
+    print(f"Saving as binary ({dtype})...")
+    header = export_binary(vectors, BIN_PATH, dtype=dtype, model_id=manifest.get('model', 'unknown'))
+    print(f"Saved to {BIN_PATH} ({header['checksum']})")
+    profiler.lap('export_binary', rows_in=vectors.shape[0], rows_out=header['shape'][0], outputs=[BIN_PATH])
+
+    if legacy_json:
+        print("Saving as JSON...")
+        export_json(vectors, JSON_PATH)
+        print(f"Saved to {JSON_PATH}")
+        profiler.lap('export_json', rows_in=vectors.shape[0], outputs=[JSON_PATH])
 
 if __name__ == '__main__':
-    convert()
+    parser = argparse.ArgumentParser(description="Export embeddings for the Node API.")
+    parser.add_argument('--dtype', choices=sorted(EXPORT_DTYPES), default='float32')
+    parser.add_argument('--json', action='store_true', help="Also write the legacy municipality_vectors.json")
+    args = parser.parse_args()
+    convert(dtype=args.dtype, legacy_json=args.json)
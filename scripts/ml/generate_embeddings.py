@@ -1,58 +1,209 @@
 import os
+import sys
+import argparse
+import hashlib
 import pandas as pd
 import numpy as np
 import json
 from sentence_transformers import SentenceTransformer
 
+from chunked_encoder import encode_to_memmap
+import _bootstrap  # noqa: F401 (scripts/ on sys.path)
+from embedding_fingerprint import read_manifest, set_digests, set_matches
+from stage_profile import Profiler
+
 # Paths
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, '../../data')
 Cleaned_CSV = os.path.join(DATA_DIR, 'cleaned/municipalities_cleaned.csv')
+# Typed columnar copy written by transform_data.py (preferred over the CSV)
+Cleaned_ARROW = os.path.join(DATA_DIR, 'cleaned/municipalities_cleaned.arrow')
 OUTPUT_EMBEDDINGS = os.path.join(DATA_DIR, 'cleaned/municipality_embeddings.npy')
 OUTPUT_METADATA = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_map.json')
+# Content hash per code (text_for_embedding + model) used by --incremental. Also the manifest of the
+# set: written last with the digests of the matrix and map, so readers can tell a finished set
+OUTPUT_HASHES = os.path.join(DATA_DIR, 'cleaned/municipality_embedding_hashes.json')
+OUTPUT_FILES = [OUTPUT_EMBEDDINGS, OUTPUT_METADATA, OUTPUT_HASHES]
 
-def generate_embeddings():
-    print("Loading Cleaned Municipality Data...")
-    if not os.path.exists(Cleaned_CSV):
-        print(f"File not found: {Cleaned_CSV}")
-        return
+MODEL_NAME = 'pkshatech/GLuCoSE-base-ja'
 
-    df = pd.read_csv(Cleaned_CSV)
-    
-    # Text Construction for Embedding
+# Columns needed for the embedding text and the code map
+TEXT_COLUMNS = ['code', 'name', 'prefecture', 'category']
+
+def build_texts(df):
+    # Build the text to embed (prefecture + name + features) column-wise
     # Combine Name, Prefecture, Category, and Phrase (if available, handled in preprocessing)
     # df['category'] used as proxy for Phrase/Characteristics
-    df['text_for_embedding'] = df.apply(lambda row: f"{row['prefecture']}{row['name']} 特徴:{row['category']}", axis=1)
-    
-    sentences = df['text_for_embedding'].tolist()
-    ids = df['code'].astype(str).tolist()
-    
-    print(f"Loading Sentence Transformer Model (pkshatech/GLuCoSE-base-ja)...")
+    return df['prefecture'].astype(str) + df['name'].astype(str) + ' 特徴:' + df['category'].astype(str)
+
+def read_cleaned():
+    # Read only the columns used for embedding (the Arrow file when present, without type inference)
+    if os.path.exists(Cleaned_ARROW):
+        return pd.read_feather(Cleaned_ARROW, columns=TEXT_COLUMNS)
+    return pd.read_csv(Cleaned_CSV, usecols=TEXT_COLUMNS, dtype={'code': str})
+
+def content_hash(text, model_name=MODEL_NAME):
+    # Per-row content hash of text and model name
+    return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+def load_model():
+    print(f"Loading Sentence Transformer Model ({MODEL_NAME})...")
     try:
         # User requested high accuracy: using GLuCoSE (PKSHA Technology)
-        model = SentenceTransformer('pkshatech/GLuCoSE-base-ja')
+        return SentenceTransformer(MODEL_NAME)
     except Exception as e:
         print(f"Failed to load model from Hub: {e}")
-        # Fallback or exit
-        return
+        return None
 
-    print(f"Generating Embeddings for {len(sentences)} municipalities...")
-    embeddings = model.encode(sentences)
-    
+def normalize(embeddings):
     # Normalization for Cosine Similarity
     # Creating unit vectors
     norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
-    normalized_embeddings = embeddings / norms
-    
-    print(f"Saving Embeddings shape: {normalized_embeddings.shape}...")
-    np.save(OUTPUT_EMBEDDINGS, normalized_embeddings)
-    
+    return embeddings / norms
+
+def atomic_write_npy(path, array):
+    # Write to a temp file and replace, so readers never see a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+def atomic_write_json(path, obj):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def save_outputs(embeddings, ids, hashes):
+    print(f"Saving Embeddings shape: {embeddings.shape}...")
+    atomic_write_npy(OUTPUT_EMBEDDINGS, embeddings)
+    save_index(ids, hashes, embeddings.shape[1])
+
+def save_index(ids, hashes, dim):
     # Save ID mapping
     mapping = {code: idx for idx, code in enumerate(ids)}
-    with open(OUTPUT_METADATA, 'w', encoding='utf-8') as f:
-        json.dump(mapping, f, ensure_ascii=False)
-        
+    atomic_write_json(OUTPUT_METADATA, mapping)
+
+    # Hashes are written last and name the matrix and map by content: until then the previous
+    # hashes file no longer matches, so readers reject the half-replaced set and the next run redoes it.
+    # dim lets the search service reject vectors that do not match the model it runs
+    atomic_write_json(OUTPUT_HASHES, {'model': MODEL_NAME, 'dim': int(dim),
+                                      'files': set_digests(OUTPUT_EMBEDDINGS, OUTPUT_METADATA), 'rows': hashes})
+
+def load_previous():
+    # Previous output (vectors, code->index, hashes), or None if unusable
+    if not all(os.path.exists(p) for p in (OUTPUT_EMBEDDINGS, OUTPUT_METADATA, OUTPUT_HASHES)):
+        return None
+    previous = read_manifest(OUTPUT_HASHES)
+    if previous.get('model') != MODEL_NAME:
+        print(f"Model changed ({previous.get('model')} -> {MODEL_NAME}), full re-encode required.")
+        return None
+    with open(OUTPUT_METADATA, 'r', encoding='utf-8') as f:
+        mapping = json.load(f)
+    embeddings = np.load(OUTPUT_EMBEDDINGS)
+    if 'files' not in previous or not set_matches(previous, OUTPUT_EMBEDDINGS, OUTPUT_METADATA):
+        print("Embedding matrix and map are not the set in the hashes file, full re-encode required.")
+        return None
+    if embeddings.shape[0] != len(mapping):
+        print("Embedding matrix and map are out of sync, full re-encode required.")
+        return None
+    if previous.get('dim') != embeddings.shape[1]:
+        print(f"Embedding dimension not recorded or not {embeddings.shape[1]}, full re-encode required.")
+        return None
+    return embeddings, mapping, previous['rows']
+
+def generate_embeddings(incremental=False, chunk_size=None, workers=1):
+    print("Loading Cleaned Municipality Data...")
+    if not os.path.exists(Cleaned_ARROW) and not os.path.exists(Cleaned_CSV):
+        print(f"File not found: {Cleaned_CSV}")
+        sys.exit(1)
+
+    profiler = Profiler()
+    df = read_cleaned()
+
+    # Text Construction for Embedding
+    df['text_for_embedding'] = build_texts(df)
+
+    sentences = df['text_for_embedding'].tolist()
+    ids = df['code'].astype(str).tolist()
+    hashes = {code: content_hash(text) for code, text in zip(ids, sentences)}
+    profiler.lap('build_texts', rows_in=len(df), rows_out=len(sentences))
+
+    previous = load_previous() if incremental else None
+    if previous is not None:
+        generate_incremental(sentences, ids, hashes, *previous, profiler=profiler)
+        return
+
+    if chunk_size:
+        # Streams chunks straight into the output .npy; an interrupted run resumes
+        print(f"Generating Embeddings for {len(sentences)} municipalities (chunked)...")
+        encode_to_memmap(sentences, OUTPUT_EMBEDDINGS, MODEL_NAME, chunk_size=chunk_size, workers=workers)
+        save_index(ids, hashes, np.load(OUTPUT_EMBEDDINGS, mmap_mode='r').shape[1])
+        profiler.lap('encode', rows_in=len(sentences), rows_out=len(ids), outputs=OUTPUT_FILES)
+        print("Embedding Generation Complete.")
+        return
+
+    model = load_model()
+    if model is None:
+        # Exit non-zero so the pipeline does not record stale embeddings as current
+        sys.exit(1)
+    profiler.lap('load_model')
+
+    print(f"Generating Embeddings for {len(sentences)} municipalities...")
+    embeddings = model.encode(sentences)
+    profiler.lap('encode', rows_in=len(sentences), rows_out=len(embeddings))
+
+    save_outputs(normalize(embeddings), ids, hashes)
+    profiler.lap('save', rows_out=len(ids), outputs=OUTPUT_FILES)
+
+    print("Embedding Generation Complete.")
+
+def generate_incremental(sentences, ids, hashes, old_embeddings, old_mapping, old_hashes, profiler=None):
+    # Re-encode only new or changed rows and drop removed ones. Existing codes keep their
+    # order and new codes are appended (indices are stable unless rows are removed)
+    profiler = profiler or Profiler()
+    text_by_code = dict(zip(ids, sentences))
+    kept = sorted((code for code in old_mapping if code in hashes), key=old_mapping.get)
+    added = [code for code in ids if code not in old_mapping]
+    changed = [code for code in kept if old_hashes.get(code) != hashes[code]]
+    removed = len(old_mapping) - len(kept)
+    print(f"Delta: {len(added)} new, {len(changed)} changed, {removed} removed, "
+          f"{len(kept) - len(changed)} unchanged")
+
+    order = kept + added
+    profiler.lap('diff', rows_in=len(ids), rows_out=len(changed) + len(added))
+    if not added and not changed and not removed:
+        print("Embeddings are up to date.")
+        return
+
+    embeddings = np.empty((len(order), old_embeddings.shape[1]), dtype=old_embeddings.dtype)
+    if kept:
+        embeddings[:len(kept)] = old_embeddings[[old_mapping[code] for code in kept]]
+
+    to_encode = changed + added
+    if to_encode:
+        model = load_model()
+        if model is None:
+            # The changed rows are recomputed on the next run
+            sys.exit(1)
+        profiler.lap('load_model')
+        print(f"Generating Embeddings for {len(to_encode)} municipalities...")
+        encoded = normalize(model.encode([text_by_code[code] for code in to_encode]))
+        position = {code: idx for idx, code in enumerate(order)}
+        embeddings[[position[code] for code in to_encode]] = encoded
+        profiler.lap('encode', rows_in=len(to_encode), rows_out=len(encoded))
+
+    save_outputs(embeddings, order, {code: hashes[code] for code in order})
+    profiler.lap('save', rows_out=len(order), outputs=OUTPUT_FILES)
     print("Embedding Generation Complete.")
 
 if __name__ == '__main__':
-    generate_embeddings()
+    parser = argparse.ArgumentParser(description="Generate municipality embeddings.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Re-encode only new or changed rows (by content hash) and drop removed ones")
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help="Encode in chunks of this size across worker processes, resumable on interruption")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Worker processes for --chunk-size")
+    args = parser.parse_args()
+    generate_embeddings(incremental=args.incremental, chunk_size=args.chunk_size, workers=args.workers)
@@ -0,0 +1,403 @@
+"""
+Incremental Data Pipeline Runner.
+
+Declares the migration and embedding scripts as stages with input / output files and skips a stage
+when the hash of its inputs, script and arguments (the stage key) matches the last success and its
+outputs are unchanged. Only changed stages and their downstream rerun; independent stages run in parallel.
+
+State lives in data/cache/pipeline_state.json. Each run's measurements (per-stage wall / CPU time,
+peak RSS, file sizes, and the substeps recorded with stage_profile.Profiler) go to the run manifest
+data/profiles/run_<id>.json (latest.json for the newest); compare runs with stage_profile.py compare.
+
+Usage:
+    python scripts/run_pipeline.py                 # run changed stages only
+    python scripts/run_pipeline.py --dry-run       # show the stages that would run
+    python scripts/run_pipeline.py --force transform
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from stage_profile import MANIFEST_ENV, PROFILE_ENV, cpu_seconds, file_sizes, maxrss_mb, read_steps
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPTS_DIR)
+STATE_PATH = os.path.join(REPO_ROOT, 'data/cache/pipeline_state.json')
+PROFILES_DIR = os.path.join(REPO_ROOT, 'data/profiles')
+
+SOURCE = 'data/source'
+CLEANED = 'data/cleaned'
+MIGRATION = 'scripts/data_migration'
+ML = 'scripts/ml'
+
+DX_SOURCES = [
+    f'{SOURCE}/都道府県のDX進捗状況_都道府県比較.csv',
+    f'{SOURCE}/市区町村毎のDX進捗状況_市区町村比較.csv',
+    f'{SOURCE}/都道府県のDX進捗状況_行政手続のオンライン申請率.csv',
+    f'{SOURCE}/市区町村毎のDX進捗状況_行政手続のオンライン申請率.csv',
+]
+
+# Paths are relative to the repository root. Stages run with the repository root as CWD.
+STAGES = [
+    {
+        'name': 'validate',
+        'script': f'{MIGRATION}/validate_source_data.py',
+        'args': [],
+        'code': [],
+        'inputs': DX_SOURCES + [
+            f'{SOURCE}/census_population.csv',
+            f'{SOURCE}/localgov_master_full.csv',
+            f'{SOURCE}/official_url_master.csv',
+        ],
+        'outputs': ['validation_report.json'],
+    },
+    {
+        'name': 'transform',
+        'script': f'{MIGRATION}/transform_data.py',
+        'args': [],
+        # Order only: never transforms sources that failed validation, but the validation report
+        # is not an input, so it does not enter the stage key
+        'after': ['validate'],
+        'code': [f'{MIGRATION}/dx_scoring.py', f'{MIGRATION}/municipality_index.py',
+                 f'{MIGRATION}/census_parser.py', f'{MIGRATION}/cleaned_table.py'],
+        'inputs': DX_SOURCES + [
+            f'{SOURCE}/census_population.csv',
+            f'{SOURCE}/localgov_master_full.csv',
+        ],
+        'outputs': [
+            f'{CLEANED}/municipalities_cleaned.csv',
+            f'{CLEANED}/municipalities_cleaned.arrow',
+            f'{CLEANED}/dx_scores_municipal_comparison.csv',
+            f'{CLEANED}/dx_scores_prefectural_comparison.csv',
+            f'{CLEANED}/dx_scores_municipal_online_rate.csv',
+            f'{CLEANED}/dx_scores_prefectural_online_rate.csv',
+            f'{CLEANED}/census_population_matrix.csv',
+            f'{CLEANED}/join_report.json',
+        ],
+    },
+    {
+        'name': 'embeddings',
+        'script': f'{ML}/generate_embeddings.py',
+        # Only rows whose embedding text changed are re-encoded
+        'args': ['--incremental'],
+        # ...so the outputs are left untouched when no text changed
+        'keeps_outputs': True,
+        'code': [f'{ML}/chunked_encoder.py', 'scripts/embedding_fingerprint.py'],
+        'inputs': [f'{CLEANED}/municipalities_cleaned.arrow'],
+        'outputs': [
+            f'{CLEANED}/municipality_embeddings.npy',
+            f'{CLEANED}/municipality_embedding_map.json',
+            f'{CLEANED}/municipality_embedding_hashes.json',
+        ],
+    },
+    {
+        'name': 'convert',
+        'script': f'{ML}/convert_embeddings.py',
+        'args': [],
+        'code': ['scripts/embedding_fingerprint.py'],
+        'inputs': [
+            f'{CLEANED}/municipality_embeddings.npy',
+            f'{CLEANED}/municipality_embedding_map.json',
+            f'{CLEANED}/municipality_embedding_hashes.json',
+        ],
+        'outputs': [f'{CLEANED}/municipality_vectors.bin'],
+    },
+    {
+        'name': 'knn',
+        'script': f'{ML}/build_knn_table.py',
+        'args': [],
+        'code': ['scripts/embedding_fingerprint.py'],
+        'inputs': [
+            f'{CLEANED}/municipality_embeddings.npy',
+            f'{CLEANED}/municipality_embedding_map.json',
+            f'{CLEANED}/municipality_embedding_hashes.json',
+        ],
+        'outputs': [f'{CLEANED}/municipality_knn.npz'],
+    },
+    {
+        'name': 'ivf',
+        'script': f'{ML}/build_ivf_index.py',
+        'args': [],
+        'code': ['scripts/embedding_fingerprint.py'],
+        'inputs': [
+            f'{CLEANED}/municipality_embeddings.npy',
+            f'{CLEANED}/municipality_embedding_map.json',
+            f'{CLEANED}/municipality_embedding_hashes.json',
+        ],
+        'outputs': [f'{CLEANED}/municipality_ivf.npz'],
+    },
+]
+STAGES.append({
+    'name': 'report',
+    'script': f'{MIGRATION}/generate_report.py',
+    'args': [],
+    'code': [f'{MIGRATION}/cleaned_table.py'],
+    # Summarises the whole run, so it waits for every other stage
+    'inputs': [path for stage in STAGES for path in stage['outputs']],
+    'outputs': ['migration_verification_report.json'],
+})
+
+
+def file_digest(path, memo):
+    # SHA-256 of a file (None if missing); reuses the previous value when size and mtime match
+    full_path = os.path.join(REPO_ROOT, path)
+    if not os.path.exists(full_path):
+        return None
+    stat = os.stat(full_path)
+    cached = memo.get(path)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['sha256']
+
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    memo[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+    return memo[path]['sha256']
+
+
+def stage_key(stage, memo):
+    # Stage key derived from the script, its arguments and its input contents
+    material = {
+        'args': stage['args'],
+        'code': {path: file_digest(path, memo) for path in [stage['script']] + stage['code']},
+        'inputs': {path: file_digest(path, memo) for path in stage['inputs']},
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def output_digests(stage, memo):
+    return {path: file_digest(path, memo) for path in stage['outputs']}
+
+
+def output_stats(stage):
+    # A rewritten file gets a new inode (os.replace) or mtime
+    stats = {}
+    for path in stage['outputs']:
+        full_path = os.path.join(REPO_ROOT, path)
+        if os.path.exists(full_path):
+            stat = os.stat(full_path)
+            stats[path] = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+        else:
+            stats[path] = None
+    return stats
+
+
+def check_outputs(stage, before):
+    # Why a stage that exited 0 still counts as failed, or None when its outputs were written
+    after = output_stats(stage)
+    missing = [path for path, stat in after.items() if stat is None]
+    if missing:
+        return f"missing outputs: {', '.join(missing)}"
+    untouched = [path for path, stat in after.items() if stat == before[path]]
+    if untouched and not stage.get('keeps_outputs'):
+        return f"outputs not rewritten: {', '.join(untouched)}"
+    return None
+
+
+def dependencies(stages):
+    # Upstream stages whose outputs each stage reads, plus the stages it must run 'after'
+    producers = {output: stage['name'] for stage in stages for output in stage['outputs']}
+    return {
+        stage['name']: {producers[path] for path in stage['inputs'] if path in producers} | set(stage.get('after', ()))
+        for stage in stages
+    }
+
+
+def load_state():
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'stages': {}, 'files': {}}
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    tmp_path = f"{STATE_PATH}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def manifest_path(manifest):
+    return os.path.join(PROFILES_DIR, f"run_{manifest['run_id']}.json")
+
+
+def save_manifest(manifest):
+    # Write the run manifest to run_<id>.json and latest.json
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    for name in (os.path.basename(manifest_path(manifest)), 'latest.json'):
+        path = os.path.join(PROFILES_DIR, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def run_stage(stage, profile_path, manifest_path):
+    # Run a stage script as a subprocess; returns (exit code, measurements)
+    env = dict(os.environ, **{PROFILE_ENV: profile_path, MANIFEST_ENV: manifest_path})
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, stage['script']] + stage['args'], cwd=REPO_ROOT, env=env)
+    # wait4 reports this child's own usage; RUSAGE_CHILDREN would mix stages running in parallel
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, {
+        'wall_s': round(time.perf_counter() - start, 3),
+        'cpu_s': round(cpu_seconds(usage), 3),
+        'peak_rss_mb': maxrss_mb(usage),
+    }
+
+
+def stage_profile(stage, returncode, error, metrics, profile_path):
+    # Manifest entry for a stage that ran (measurements, file sizes, substeps)
+    steps = read_steps(profile_path)
+    if os.path.exists(profile_path):
+        os.remove(profile_path)
+    return {
+        'status': 'ran' if error is None else 'failed',
+        'returncode': returncode,
+        'error': error,
+        **metrics,
+        'inputs': file_sizes(stage['inputs'], root=REPO_ROOT),
+        'outputs': file_sizes(stage['outputs'], root=REPO_ROOT),
+        'steps': steps,
+    }
+
+
+def run_pipeline(stages=STAGES, jobs=2, force=(), dry_run=False):
+    # Run changed stages and their downstream, in parallel where dependencies allow
+    state = load_state()
+    memo = state.setdefault('files', {})
+    deps = dependencies(stages)
+    pending = {stage['name']: stage for stage in stages}
+    running = {}
+    results = {}
+    manifest = {
+        'run_id': time.strftime('%Y%m%d-%H%M%S'),
+        'commit': git_commit(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'finished_at': None,
+        'status': 'running',
+        'jobs': jobs,
+        'forced': sorted(force),
+        'stages': {},
+    }
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if deps[name] & (set(pending) | {n for n, *_ in running.values()}):
+                    continue
+                del pending[name]
+                upstream = {results[dep] for dep in deps[name]}
+                if upstream & {'failed', 'blocked'}:
+                    results[name] = 'blocked'
+                    print(f"[{name}] blocked by failed upstream stage")
+                    continue
+                if dry_run and upstream & {'would run', 'may run'}:
+                    results[name] = 'may run'
+                    print(f"[{name}] may run (depends on changed stages)")
+                    continue
+
+                # Computed on the main thread only, so the digest memo needs no lock
+                key = stage_key(stage, memo)
+                previous = state['stages'].get(name)
+                if (name not in force and previous and previous['key'] == key
+                        and previous['outputs'] == output_digests(stage, memo)):
+                    results[name] = 'skipped'
+                    print(f"[{name}] up to date, skipped")
+                    continue
+                if dry_run:
+                    results[name] = 'would run'
+                    print(f"[{name}] would run")
+                    continue
+
+                print(f"[{name}] running {stage['script']} {' '.join(stage['args'])}".rstrip())
+                profile_path = os.path.join(PROFILES_DIR, f".{manifest['run_id']}_{name}.jsonl")
+                before = output_stats(stage)
+                future = executor.submit(run_stage, stage, profile_path, manifest_path(manifest))
+                running[future] = (name, key, profile_path, before, time.perf_counter())
+
+            if not dry_run:
+                # Skipped and blocked stages are recorded as soon as they are decided
+                for name, status in results.items():
+                    manifest['stages'].setdefault(name, {'status': status})
+                manifest['stages'].update({name: {'status': 'running'} for name, *_ in running.values()})
+                save_manifest(manifest)
+
+            if not running:
+                if pending:
+                    raise RuntimeError(f"Dependency cycle between stages: {sorted(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, key, profile_path, before, started = running.pop(future)
+                stage = next(s for s in stages if s['name'] == name)
+                try:
+                    returncode, metrics = future.result()
+                    # Exit code 0 alone is not trusted: the declared outputs must have been written
+                    error = f"exit code {returncode}" if returncode != 0 else check_outputs(stage, before)
+                    manifest['stages'][name] = stage_profile(stage, returncode, error, metrics, profile_path)
+                except Exception as e:
+                    # A stage that could not be started or checked fails like a non-zero exit: it is
+                    # recorded and its downstream stages are blocked instead of aborting the run
+                    error = f"{type(e).__name__}: {e}"
+                    metrics = {'wall_s': round(time.perf_counter() - started, 3)}
+                    manifest['stages'][name] = {'status': 'failed', 'returncode': None, 'error': error, **metrics}
+                seconds = metrics['wall_s']
+                if error is None:
+                    state['stages'][name] = {
+                        'key': key,
+                        'outputs': output_digests(stage, memo),
+                        'seconds': round(seconds, 3),
+                        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    }
+                    results[name] = 'ran'
+                    print(f"[{name}] done in {seconds:.1f}s")
+                else:
+                    state['stages'].pop(name, None)
+                    results[name] = 'failed'
+                    print(f"[{name}] FAILED after {seconds:.1f}s ({error})")
+                if not dry_run:
+                    save_state(state)
+                    # Written before any downstream stage starts, so the report sees finished stages
+                    save_manifest(manifest)
+
+    if not dry_run:
+        for name, status in results.items():
+            manifest['stages'].setdefault(name, {'status': status})
+        failed = any(status in ('failed', 'blocked') for status in results.values())
+        manifest.update(status='failed' if failed else 'success', finished_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        save_manifest(manifest)
+        print(f"Run manifest: {manifest_path(manifest)}")
+    return results
+
+
+if __name__ == '__main__':
+    stage_names = [stage['name'] for stage in STAGES]
+    parser = argparse.ArgumentParser(description="Run the data pipeline incrementally.")
+    parser.add_argument('--jobs', type=int, default=2, help="Stages to run in parallel")
+    parser.add_argument('--force', nargs='*', default=[], choices=stage_names,
+                        help="Run these stages even if up to date")
+    parser.add_argument('--dry-run', action='store_true', help="Only show which stages would run")
+    args = parser.parse_args()
+
+    results = run_pipeline(jobs=args.jobs, force=set(args.force), dry_run=args.dry_run)
+    print(json.dumps(results, indent=2))
+    if any(status in ('failed', 'blocked') for status in results.values()):
+        sys.exit(1)
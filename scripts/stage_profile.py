@@ -0,0 +1,149 @@
+"""
+Stage Profiling for the data pipeline.
+
+Records wall time, CPU time, peak RSS, row counts and artifact sizes for each substep (DX scoring,
+merge, encode, ...) of the migration and embedding scripts.
+
+run_pipeline.py sets PIPELINE_PROFILE_PATH for each stage and collects the appended substeps, with
+the stage's own child rusage, into the run manifest data/profiles/run_<id>.json. Run standalone, a
+script just prints its timings (each directory's _bootstrap.py puts scripts/ on sys.path).
+
+Peak RSS is ru_maxrss, the maximum since process start, so a substep reports the peak up to its end;
+the substep where it grows is the one that set the peak.
+
+Usage:
+    python scripts/stage_profile.py compare data/profiles/run_A.json data/profiles/run_B.json
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+
+PROFILE_ENV = 'PIPELINE_PROFILE_PATH'
+# Manifest of the run a stage belongs to (read by generate_report.py)
+MANIFEST_ENV = 'PIPELINE_RUN_MANIFEST'
+
+# Relative change reported as a regression by compare
+REGRESSION_THRESHOLD = 0.2
+# Timings shorter than this are too noisy to flag
+MIN_FLAG_SECONDS = 0.5
+
+
+def maxrss_mb(usage):
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(usage.ru_maxrss / scale, 1)
+
+
+def cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def file_sizes(paths, root=None):
+    # Size in bytes of each file (None if missing), keyed by path relative to root (default: CWD)
+    sizes = {}
+    for path in paths:
+        full_path = os.path.join(root, path) if root else path
+        sizes[os.path.relpath(full_path, root)] = os.path.getsize(full_path) if os.path.exists(full_path) else None
+    return sizes
+
+
+class Profiler:
+    # Times the substeps of a script; lap(name) records the span since the previous lap (or start)
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else os.getenv(PROFILE_ENV)
+        self.steps = []
+        self._mark = self._now()
+
+    @staticmethod
+    def _now():
+        return time.perf_counter(), cpu_seconds(resource.getrusage(resource.RUSAGE_SELF))
+
+    def lap(self, name, rows_in=None, rows_out=None, outputs=()):
+        wall_end, cpu_end = self._now()
+        step = {
+            'name': name,
+            'wall_s': round(wall_end - self._mark[0], 3),
+            'cpu_s': round(cpu_end - self._mark[1], 3),
+            'peak_rss_mb': maxrss_mb(resource.getrusage(resource.RUSAGE_SELF)),
+            'rows_in': rows_in,
+            'rows_out': rows_out,
+            'outputs': file_sizes(outputs),
+        }
+        self.steps.append(step)
+        self._mark = (wall_end, cpu_end)
+        print(f"[profile] {name}: {step['wall_s']}s wall, {step['cpu_s']}s cpu, peak {step['peak_rss_mb']} MB")
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(step, ensure_ascii=False) + '\n')
+        return step
+
+
+def read_steps(path):
+    # Read the JSON Lines appended by Profiler
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _change(old, new):
+    if old is None or new is None:
+        return None
+    if old == 0:
+        return None if new == 0 else float('inf')
+    return (new - old) / old
+
+
+def compare(old_path, new_path, threshold=REGRESSION_THRESHOLD):
+    # Compare wall / CPU / peak RSS per stage and substep of two run manifests;
+    # returns the increases above threshold as regressions
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f"{old.get('run_id')} ({old.get('commit')}) -> {new.get('run_id')} ({new.get('commit')})")
+    regressions = []
+    for stage_name, stage in new['stages'].items():
+        before = old['stages'].get(stage_name)
+        if before is None or before.get('status') != 'ran' or stage.get('status') != 'ran':
+            continue
+        entries = [(stage_name, before, stage)]
+        old_steps = {step['name']: step for step in before.get('steps', [])}
+        entries += [(f"{stage_name}/{step['name']}", old_steps[step['name']], step)
+                    for step in stage.get('steps', []) if step['name'] in old_steps]
+        for label, a, b in entries:
+            parts = []
+            for metric in ('wall_s', 'cpu_s', 'peak_rss_mb'):
+                change = _change(a.get(metric), b.get(metric))
+                if change is None:
+                    continue
+                parts.append(f"{metric} {a[metric]} -> {b[metric]} ({change:+.0%})")
+                noisy = metric != 'peak_rss_mb' and b[metric] < MIN_FLAG_SECONDS
+                if change > threshold and not noisy:
+                    regressions.append((label, metric, a[metric], b[metric]))
+            for metric in ('rows_in', 'rows_out'):
+                if a.get(metric) != b.get(metric) and b.get(metric) is not None:
+                    parts.append(f"{metric} {a.get(metric)} -> {b[metric]}")
+            print(f"  {label:<32} " + ", ".join(parts))
+
+    for label, metric, before, after in regressions:
+        print(f"REGRESSION {label}: {metric} {before} -> {after}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare pipeline run manifests.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    compare_parser = sub.add_parser('compare', help="Compare two run manifests")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                                help="Relative increase reported as a regression (default 0.2)")
+    args = parser.parse_args()
+    if compare(args.old, args.new, args.threshold):
+        sys.exit(1)
@@ -0,0 +1,114 @@
+import os
+import sys
+
+# Same import layout as running scripts/data_migration/load_database.py directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'data_migration'))
+
+import load_database  # noqa: E402
+from create_indexes import INDEXES  # noqa: E402
+
+
+class RecordingCursor:
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, sql, params=None):
+        self.log.append(' '.join(sql.split()))
+
+    def copy_expert(self, sql, stream):
+        self.log.append(f"{sql} <- {stream.getvalue()!r}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class RecordingConnection:
+    # `with conn` is one transaction, committed on success and rolled back on error, as in psycopg2
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return RecordingCursor(self.log)
+
+    def __enter__(self):
+        self.log.append('BEGIN')
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.log.append('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+    def close(self):
+        self.log.append('CLOSE')
+
+
+def run_load(monkeypatch, tmp_path, verification='success'):
+    conn = RecordingConnection()
+    monkeypatch.setattr(load_database, 'connect', lambda: conn)
+    monkeypatch.setattr(load_database, 'municipality_batches',
+                        lambda batch_rows: iter([(2, '01100,a\n01101,b\n'), (1, '01102,c\n')]))
+    monkeypatch.setattr(load_database, 'verify_migration', lambda conn, staged: {'status': verification})
+    monkeypatch.setattr(load_database, 'REPORT_FILE', str(tmp_path / 'db_import_report.json'))
+    report = load_database.load_database(include_embeddings=False)
+    return report, conn.log
+
+
+def test_swap_moves_live_aside_then_drops_it():
+    log = []
+    load_database.swap_tables(RecordingCursor(log), 'municipality_embeddings')
+    assert log == [
+        'ALTER TABLE IF EXISTS municipality_embeddings RENAME TO municipality_embeddings_old',
+        'ALTER INDEX IF EXISTS municipality_embeddings_pkey RENAME TO municipality_embeddings_pkey_old',
+        'ALTER TABLE municipality_embeddings_staging RENAME TO municipality_embeddings',
+        'ALTER INDEX municipality_embeddings_pkey_staging RENAME TO municipality_embeddings_pkey',
+        'DROP TABLE IF EXISTS municipality_embeddings_old',
+    ]
+
+
+def test_copy_batches_streams_each_batch():
+    log = []
+    rows = load_database.copy_batches(RecordingCursor(log), 't_staging', ['code', 'name'],
+                                      iter([(2, 'a,1\nb,2\n'), (1, 'c,3\n')]))
+    assert rows == 3
+    assert log == [
+        "COPY t_staging (code, name) FROM STDIN WITH (FORMAT csv) <- 'a,1\\nb,2\\n'",
+        "COPY t_staging (code, name) FROM STDIN WITH (FORMAT csv) <- 'c,3\\n'",
+    ]
+
+
+def test_load_copies_indexes_then_swaps_in_one_transaction(monkeypatch, tmp_path):
+    report, log = run_load(monkeypatch, tmp_path)
+    assert report['status'] == 'success'
+    assert report['tables']['municipalities']['rows'] == 3
+
+    # Staging transaction: fresh table, COPY batches, then the indexes
+    first_commit = log.index('COMMIT')
+    staging = log[1:first_commit]
+    assert staging[0] == 'DROP TABLE IF EXISTS municipalities_staging'
+    assert staging[1].startswith('CREATE TABLE municipalities_staging (')
+    assert [s.split(' <- ')[0] for s in staging[2:4]] == [
+        'COPY municipalities_staging (code, name, prefecture, population, budget, score, category) '
+        'FROM STDIN WITH (FORMAT csv)'] * 2
+    assert staging[4:] == [definition.format(table='municipalities_staging', name=f'{name}_staging')
+                           for name, definition in INDEXES['municipalities']]
+
+    # Swap transaction: live -> backup, staging -> live, drop backup, committed together
+    swap = log[first_commit + 1:]
+    assert swap[0] == 'BEGIN' and swap[-2:] == ['COMMIT', 'CLOSE']
+    statements = swap[1:-2]
+    assert statements[0] == 'ALTER TABLE IF EXISTS municipalities RENAME TO municipalities_old'
+    assert 'ALTER TABLE municipalities_staging RENAME TO municipalities' in statements
+    assert statements[-1] == 'DROP TABLE IF EXISTS municipalities_old'
+    assert statements.index('ALTER INDEX IF EXISTS municipalities_pkey RENAME TO municipalities_pkey_old') < \
+        statements.index('ALTER INDEX municipalities_pkey_staging RENAME TO municipalities_pkey')
+
+
+def test_failed_verification_leaves_live_tables(monkeypatch, tmp_path):
+    report, log = run_load(monkeypatch, tmp_path, verification='failure')
+    assert report['status'] == 'failure'
+    assert not any('RENAME' in statement or statement == 'DROP TABLE IF EXISTS municipalities_old'
+                   for statement in log)
+    assert log[-2:] == ['COMMIT', 'CLOSE']